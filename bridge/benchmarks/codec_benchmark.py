@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+JSON codec benchmark.
+
+Compares the stdlib and orjson backends of JSONCodec on a get_nodes sized
+response (decode) and on single attribute updates and MQTT payloads.
+
+Usage:
+    python3 benchmarks/codec_benchmark.py [--nodes 200] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matter_mqtt_bridge import JSONCodec, orjson  # noqa: E402
+from synthetic import make_attribute_update, make_nodes  # noqa: E402
+
+
+def bench(label: str, func, number: int) -> float:
+    """Run func number times and print the mean in microseconds."""
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {label:<28} {seconds * 1e6:12.1f} µs")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nodes', type=int, default=200, help='nodes in the snapshot')
+    parser.add_argument('--repeat', type=int, default=20, help='snapshot iterations')
+    args = parser.parse_args()
+    
+    snapshot = json.dumps({"message_id": "1", "result": make_nodes(args.nodes)})
+    update = json.dumps(make_attribute_update(1))
+    payload = {"temperature": 21.5, "unit": "°C", "timestamp": "2026-02-01T10:00:00+00:00"}
+    print(f"Snapshot: {args.nodes} nodes, {len(snapshot) / 1024:.0f} KiB; update: {len(update)} bytes")
+    
+    backends = ['json'] + (['orjson'] if orjson is not None else [])
+    results = {}
+    for backend in backends:
+        codec = JSONCodec(backend)
+        print(f"{backend}:")
+        results[backend] = (
+            bench("decode snapshot", lambda: codec.loads(snapshot), args.repeat),
+            bench("decode update", lambda: codec.loads(update), 20000),
+            bench("encode payload", lambda: codec.dumps(payload), 20000),
+        )
+    
+    if len(results) == 2:
+        print("orjson speedup:")
+        for label, base, fast in zip(("decode snapshot", "decode update", "encode payload"),
+                                     results['json'], results['orjson']):
+            print(f"  {label:<28} {base / fast:11.1f}x")
+    else:
+        print("orjson not installed, only the stdlib backend was measured")
+
+
+if __name__ == "__main__":
+    main()
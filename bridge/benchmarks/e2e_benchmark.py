@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+End-to-end bridge benchmark.
+
+Runs matter_mqtt_bridge.py as a subprocess between a fake Matter server
+(synthetic nodes, start_listening snapshot, then a stream of
+attribute_updated events at a fixed rate) and an in-process MQTT broker
+stand-in, and measures websocket-send to MQTT-receive latency, throughput,
+snapshot time (every node online), time until every node's first sensor
+value arrived, CPU and peak RSS of the bridge process.
+
+Results can be stored as a baseline and later runs compared against it;
+the script exits with status 1 when a metric regresses beyond the tolerance.
+
+Usage:
+    python3 benchmarks/e2e_benchmark.py [--nodes 100] [--rate 200] [--duration 10]
+    python3 benchmarks/e2e_benchmark.py --save-baseline     # record this machine's numbers
+    python3 benchmarks/e2e_benchmark.py --check             # fail on regression
+
+No baseline is committed (numbers are machine specific), so --check exits
+with status 1 until --save-baseline has been run for the same scenario on
+the same machine, e.g. in CI on the base commit before checking a change.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BRIDGE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import FakeMatterServer, FakeMQTTBroker  # noqa: E402
+from synthetic import make_nodes  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baselines.json')
+
+# Streamed attribute: CO2 (1/1037/0) keeps the value unscaled, so the event
+# sequence number survives conversion and identifies the MQTT message.
+STREAM_PATH = "1/1037/0"
+STREAM_KEY = "co2"
+# Keeps sequence numbers clear of the CO2 values in the node snapshot
+SEQUENCE_BASE = 1_000_000
+
+# metric -> True if higher is better
+METRICS = {
+    'snapshot_s': False,
+    'first_value_s': False,
+    'latency_p50_ms': False,
+    'latency_p95_ms': False,
+    'latency_p99_ms': False,
+    'throughput_msg_s': True,
+    'delivered_ratio': True,
+    'cpu_s': False,
+    'max_rss_mb': False,
+}
+# Absolute slack so sub-millisecond noise does not count as a regression
+LATENCY_SLACK_MS = 1.0
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+class Recorder:
+    """Collects MQTT arrivals from the fake broker."""
+
+    def __init__(self):
+        self.online = set()
+        self.all_online = asyncio.Event()
+        self.expected_nodes = 0
+        self.last_online: Optional[float] = None
+        self.valued = set()  # Nodes whose snapshot CO2 value arrived
+        self.last_value: Optional[float] = None
+        self.arrivals: Dict[int, float] = {}  # sequence -> perf_counter
+
+    def on_publish(self, topic: str, payload: bytes, received: float):
+        if topic.endswith('/availability'):
+            if payload == b'online' and topic not in self.online:
+                self.online.add(topic)
+                self.last_online = received
+                if len(self.online) >= self.expected_nodes:
+                    self.all_online.set()
+        elif topic.endswith(f'/{STREAM_KEY}'):
+            try:
+                sequence = int(json.loads(payload)[STREAM_KEY])
+            except (ValueError, KeyError, TypeError):
+                return
+            if sequence >= SEQUENCE_BASE:
+                self.arrivals.setdefault(sequence, received)
+            elif topic not in self.valued:
+                self.valued.add(topic)
+                self.last_value = received
+
+
+def write_config(path: str, base_config: Optional[str]):
+    """Write a bridge config with persistence and capture disabled."""
+    config: Dict = {}
+    if base_config:
+        with open(base_config, 'r') as f:
+            config = yaml.safe_load(f) or {}
+    config['devices'] = config.get('devices') or {}
+    bridge_config = config.setdefault('bridge', {})
+    bridge_config['state_file'] = ''
+    bridge_config['capture_file'] = ''
+    bridge_config.setdefault('availability_timeout', 0)
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+
+async def stream_updates(server: FakeMatterServer, nodes: int, rate: float, duration: float) -> Dict[int, float]:
+    """Send attribute_updated events at a fixed rate; return send times."""
+    sent: Dict[int, float] = {}
+    total = int(rate * duration)
+    start = time.perf_counter()
+    for index in range(total):
+        delay = start + index / rate - time.perf_counter()
+        if delay > 0.001:
+            await asyncio.sleep(delay)
+        sequence = SEQUENCE_BASE + index
+        node_id = index % nodes + 1
+        sent[sequence] = time.perf_counter()
+        await server.broadcast({"event": "attribute_updated",
+                                "data": [node_id, STREAM_PATH, float(sequence)]})
+    return sent
+
+
+async def run_benchmark(args) -> Dict[str, float]:
+    """Run one scenario and return its metrics."""
+    recorder = Recorder()
+    recorder.expected_nodes = args.nodes
+    server = FakeMatterServer(make_nodes(args.nodes, args.extra_attributes))
+    broker = FakeMQTTBroker(recorder.on_publish)
+    await server.start()
+    await broker.start()
+
+    workdir = tempfile.mkdtemp(prefix='bridge-bench-')
+    config_path = os.path.join(workdir, 'bridge-config.yaml')
+    write_config(config_path, args.config)
+    env = dict(os.environ,
+               MATTER_SERVER_URL=f"ws://127.0.0.1:{server.port}/ws",
+               MQTT_BROKER='127.0.0.1',
+               MQTT_PORT=str(broker.port),
+               CONFIG_FILE=config_path,
+               EVENT_LOOP=args.event_loop)
+    log_path = os.path.join(workdir, 'bridge.log')
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, os.path.join(BRIDGE_DIR, 'matter_mqtt_bridge.py')],
+                                   env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        await asyncio.wait_for(server.listening.wait(), args.timeout)
+        await asyncio.wait_for(recorder.all_online.wait(), args.timeout)
+        snapshot_s = recorder.last_online - server.snapshot_sent
+        first_value_s = (recorder.last_value - server.snapshot_sent
+                         if len(recorder.valued) >= args.nodes else None)
+
+        stream_start = time.perf_counter()
+        sent = await stream_updates(server, args.nodes, args.rate, args.duration)
+        deadline = time.perf_counter() + args.drain
+        while len(recorder.arrivals) < len(sent) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        stream_end = max(recorder.arrivals.values(), default=time.perf_counter())
+    except asyncio.TimeoutError:
+        print(f"Bridge did not finish the snapshot within {args.timeout}s, log: {log_path}")
+        process.kill()
+        raise SystemExit(2)
+    finally:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+        _, _, usage = await asyncio.to_thread(os.wait4, process.pid, 0)
+        process.returncode = 0
+        await server.stop()
+        await broker.stop()
+
+    latencies = sorted((recorder.arrivals[seq] - sent_at) * 1000
+                       for seq, sent_at in sent.items() if seq in recorder.arrivals)
+    return {
+        'snapshot_s': round(snapshot_s, 3),
+        'first_value_s': round(first_value_s, 3) if first_value_s is not None else -1.0,
+        'latency_p50_ms': round(percentile(latencies, 0.50), 3),
+        'latency_p95_ms': round(percentile(latencies, 0.95), 3),
+        'latency_p99_ms': round(percentile(latencies, 0.99), 3),
+        'latency_max_ms': round(latencies[-1] if latencies else 0.0, 3),
+        'throughput_msg_s': round(len(latencies) / max(stream_end - stream_start, 1e-9), 1),
+        'delivered_ratio': round(len(latencies) / max(len(sent), 1), 4),
+        'mqtt_publishes': broker.publish_count,
+        'cpu_s': round(usage.ru_utime + usage.ru_stime, 3),
+        'max_rss_mb': round(usage.ru_maxrss / 1024, 1),
+    }
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """Return a description of every metric that regressed."""
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        if metric not in baseline:
+            continue
+        base, current = baseline[metric], results[metric]
+        if higher_is_better:
+            limit = base * (1 - tolerance)
+            failed = current < limit
+        else:
+            limit = base * (1 + tolerance)
+            if metric.endswith('_ms'):
+                limit += LATENCY_SLACK_MS
+            failed = current > limit
+        if failed:
+            regressions.append(f"{metric}: {current} (baseline {base}, limit {limit:.3f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nodes', type=int, default=100, help='synthetic nodes')
+    parser.add_argument('--extra-attributes', type=int, default=120, help='filler attributes per node')
+    parser.add_argument('--rate', type=float, default=200, help='attribute updates per second')
+    parser.add_argument('--duration', type=float, default=10, help='streaming time (seconds)')
+    parser.add_argument('--drain', type=float, default=5, help='wait for late messages (seconds)')
+    parser.add_argument('--timeout', type=float, default=60, help='startup/snapshot timeout (seconds)')
+    parser.add_argument('--config', help='bridge-config.yaml to benchmark with (devices are kept)')
+    parser.add_argument('--event-loop', choices=('asyncio', 'uvloop'), default='asyncio',
+                        help='event loop of the bridge (EVENT_LOOP)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store results as the baseline')
+    parser.add_argument('--check', action='store_true', help='exit 1 if a metric regressed')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    scenario = f"nodes{args.nodes}_rate{args.rate:g}_duration{args.duration:g}"
+    if args.event_loop != 'asyncio':
+        scenario += f"_{args.event_loop}"
+    print(f"Scenario {scenario}")
+    results = asyncio.run(run_benchmark(args))
+    for metric, value in results.items():
+        print(f"  {metric:<20} {value}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({scenario: results}, f, indent=2)
+
+    baselines: Dict = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[scenario] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif args.check:
+        if scenario not in baselines:
+            print(f"No baseline for {scenario} in {args.baseline}, run with --save-baseline first")
+            sys.exit(1)
+        regressions = compare(results, baselines[scenario], args.tolerance)
+        if regressions:
+            print("Regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against baseline (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
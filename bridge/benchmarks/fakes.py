@@ -0,0 +1,150 @@
+"""
+Local stand-ins for python-matter-server and an MQTT broker.
+
+FakeMatterServer answers get_nodes / get_node / start_listening with
+synthetic nodes and can stream attribute_updated events to listening
+clients. FakeMQTTBroker implements just enough MQTT 3.1.1 for one bridge
+connection (CONNECT, SUBSCRIBE, PUBLISH QoS 0/1, PINGREQ, DISCONNECT) and
+reports every received PUBLISH with its arrival time.
+"""
+
+import asyncio
+import json
+import time
+from typing import Callable, Dict, List, Optional
+
+import websockets
+
+
+class FakeMatterServer:
+    """Minimal python-matter-server websocket endpoint."""
+
+    def __init__(self, nodes: List[Dict]):
+        self.nodes = nodes
+        self.nodes_by_id = {node['node_id']: node for node in nodes}
+        self.listeners: List = []
+        self.listening = asyncio.Event()
+        self.snapshot_sent: Optional[float] = None  # perf_counter of the start_listening reply
+        self.server = None
+        self.port = 0
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        """Start serving; the chosen port is stored in self.port."""
+        self.server = await websockets.serve(self._handler, host, port, max_size=None)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop serving."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handler(self, websocket):
+        await websocket.send(json.dumps({"fabric_id": 1, "schema_version": 11, "sdk_version": "fake"}))
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                await self._answer(websocket, request)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            if websocket in self.listeners:
+                self.listeners.remove(websocket)
+
+    async def _answer(self, websocket, request: Dict):
+        message_id = request.get('message_id')
+        command = request.get('command')
+        args = request.get('args') or {}
+
+        if command == 'start_listening':
+            await websocket.send(json.dumps({"message_id": message_id, "result": self.nodes}))
+            self.snapshot_sent = time.perf_counter()
+            self.listeners.append(websocket)
+            self.listening.set()
+        elif command == 'get_nodes':
+            await websocket.send(json.dumps({"message_id": message_id, "result": self.nodes}))
+        elif command == 'get_node' and args.get('node_id') in self.nodes_by_id:
+            result = self.nodes_by_id[args['node_id']]
+            await websocket.send(json.dumps({"message_id": message_id, "result": result}))
+        elif command == 'device.send_command':
+            await websocket.send(json.dumps({"message_id": message_id, "result": None}))
+        else:
+            await websocket.send(json.dumps({
+                "message_id": message_id, "error_code": 1, "details": f"Unsupported command {command}"
+            }))
+
+    async def broadcast(self, event: Dict):
+        """Send an event to every listening client."""
+        frame = json.dumps(event)
+        for websocket in list(self.listeners):
+            await websocket.send(frame)
+
+
+class FakeMQTTBroker:
+    """Single-purpose MQTT 3.1.1 sink that records PUBLISH arrivals."""
+
+    def __init__(self, on_publish: Callable[[str, bytes, float], None]):
+        self.on_publish = on_publish  # (topic, payload, perf_counter)
+        self.server = None
+        self.port = 0
+        self.publish_count = 0
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        """Start listening; the chosen port is stored in self.port."""
+        self.server = await asyncio.start_server(self._handle_client, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    async def _read_packet(reader: asyncio.StreamReader):
+        header = (await reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        body = await reader.readexactly(length) if length else b""
+        return header, body
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header, body = await self._read_packet(reader)
+                packet_type = header >> 4
+                if packet_type == 1:  # CONNECT
+                    writer.write(b"\x20\x02\x00\x00")
+                elif packet_type == 3:  # PUBLISH
+                    received = time.perf_counter()
+                    qos = (header >> 1) & 0x03
+                    topic_length = int.from_bytes(body[0:2], 'big')
+                    topic = body[2:2 + topic_length].decode('utf-8')
+                    offset = 2 + topic_length
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        writer.write(b"\x40\x02" + packet_id)  # PUBACK
+                    self.publish_count += 1
+                    self.on_publish(topic, body[offset:], received)
+                elif packet_type == 8:  # SUBSCRIBE
+                    packet_id = body[0:2]
+                    granted, offset = bytearray(), 2
+                    while offset < len(body):
+                        topic_length = int.from_bytes(body[offset:offset + 2], 'big')
+                        offset += 2 + topic_length
+                        granted.append(min(body[offset], 1))
+                        offset += 1
+                    writer.write(bytes([0x90, 2 + len(granted)]) + packet_id + bytes(granted))
+                elif packet_type == 12:  # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif packet_type == 14:  # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
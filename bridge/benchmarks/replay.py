@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Replay captured Matter server traffic through the bridge.
+
+Reads a capture written with bridge.capture_file and feeds every frame to
+MatterMQTTBridge.handle_matter_message (or through the ingest pipeline with
+--ingest) with MQTT publishing replaced by a null or counting sink. Node
+snapshots in the capture (start_listening / get_nodes / get_node results)
+register the nodes first, like a live connection would.
+
+Usage:
+    python3 benchmarks/replay.py capture.log.gz                  # as fast as possible
+    python3 benchmarks/replay.py capture.log.gz --speed 1         # real time
+    python3 benchmarks/replay.py capture.log.gz --speed 10 --sink count
+    python3 benchmarks/replay.py capture.log.gz --profile replay.prof
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from e2e_benchmark import write_config  # noqa: E402
+
+
+class NullSink:
+    """Stands in for the paho client and the asyncio adapter; drops everything."""
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False):
+        self.published += 1
+
+    def want_write(self) -> bool:
+        return False
+
+
+class CountingSink(NullSink):
+    """Counts publishes and payload bytes per topic class."""
+
+    def __init__(self):
+        super().__init__()
+        self.topics = Counter()
+        self.payload_bytes = 0
+
+    @staticmethod
+    def topic_class(topic: str) -> str:
+        if '/bridge/' in topic:
+            return 'bridge'
+        if '/cluster_' in topic:
+            return 'generic'
+        return topic.rsplit('/', 1)[-1]
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False):
+        self.published += 1
+        self.topics[self.topic_class(topic)] += 1
+        if payload is not None:
+            self.payload_bytes += len(payload)
+
+
+class SinkAdapter:
+    """Stands in for AsyncioMQTTAdapter; a sink never has unwritten data."""
+
+    async def wait_drained(self):
+        pass
+
+
+async def feed(bridge, frame: str, use_ingest: bool):
+    """Hand one captured frame to the bridge."""
+    try:
+        data = json.loads(frame)
+    except ValueError:
+        return
+    result = data.get('result') if 'event' not in data else None
+    if isinstance(result, list) and result and isinstance(result[0], dict) and 'node_id' in result[0]:
+        await bridge.register_nodes(result)
+    elif isinstance(result, dict) and 'node_id' in result:
+        await bridge.register_node(result)
+    elif use_ingest:
+        await bridge.ingest.put(frame)
+    else:
+        await bridge.handle_matter_message(frame)
+
+
+async def drain_ingest(ingest):
+    """Wait until the ingest pipeline has handled everything queued."""
+    while ingest.frames.qsize() or any(shard.qsize() for shard in ingest.shards):
+        await asyncio.sleep(0.01)
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def replay(args, bridge_module, sink: NullSink):
+    """Replay the capture and return (frames, seconds)."""
+    bridge = bridge_module.MatterMQTTBridge()
+    bridge_module.logger.setLevel('WARNING')
+    bridge.running = True
+    bridge.mqtt_client = sink
+    bridge.mqtt_adapter = SinkAdapter()
+    bridge.mqtt_connected.set()
+    # Replay measures handling cost, publish the snapshot backlog unthrottled
+    bridge.snapshot_backlog.rate = 0
+    drain = asyncio.create_task(bridge.drain_outbound())
+    backlog = asyncio.create_task(bridge.snapshot_backlog.run())
+    if args.ingest:
+        bridge.ingest.start()
+
+    frames = list(bridge_module.FrameCapture.read(args.capture))
+    if args.limit:
+        frames = frames[:args.limit]
+
+    start = time.perf_counter()
+    for offset, frame in frames:
+        if args.speed > 0:
+            delay = start + offset / args.speed - time.perf_counter()
+            if delay > 0.001:
+                await asyncio.sleep(delay)
+        await feed(bridge, frame, args.ingest)
+    if args.ingest:
+        await drain_ingest(bridge.ingest)
+        bridge.ingest.stop()
+    while len(bridge.outbound) or len(bridge.snapshot_backlog):
+        await asyncio.sleep(0)
+    drain.cancel()
+    backlog.cancel()
+    return len(frames), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('capture', help='capture file (bridge.capture_file)')
+    parser.add_argument('--speed', type=float, default=0, help='1 = real time, N = N times faster, 0 = max')
+    parser.add_argument('--sink', choices=('null', 'count'), default='null', help='MQTT stand-in')
+    parser.add_argument('--ingest', action='store_true', help='go through the ingest pipeline workers')
+    parser.add_argument('--config', help='bridge-config.yaml to replay with (devices are kept)')
+    parser.add_argument('--limit', type=int, default=0, help='replay only the first N frames')
+    parser.add_argument('--profile', help='write cProfile stats to this file')
+    args = parser.parse_args()
+
+    # The bridge reads CONFIG_FILE at import time
+    config_path = os.path.join(tempfile.mkdtemp(prefix='bridge-replay-'), 'bridge-config.yaml')
+    write_config(config_path, args.config)
+    os.environ['CONFIG_FILE'] = config_path
+    import matter_mqtt_bridge
+
+    sink = CountingSink() if args.sink == 'count' else NullSink()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    frames, seconds = asyncio.run(replay(args, matter_mqtt_bridge, sink))
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    print(f"Replayed {frames} frames in {seconds:.3f}s ({frames / max(seconds, 1e-9):.0f} frames/s)")
+    print(f"Published {sink.published} messages")
+    if isinstance(sink, CountingSink):
+        print(f"Payload bytes: {sink.payload_bytes}")
+        for topic_class, count in sink.topics.most_common():
+            print(f"  {topic_class:<20} {count}")
+    if profiler:
+        print(f"Profile written to {args.profile} (python3 -m pstats {args.profile})")
+
+
+if __name__ == "__main__":
+    main()
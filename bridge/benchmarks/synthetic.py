@@ -0,0 +1,68 @@
+"""
+Synthetic python-matter-server payloads for benchmarks.
+
+Nodes look like an IKEA ALPSTUGA / TIMMERFLOTTE as returned by get_nodes:
+descriptor, basic information, diagnostics lists and the sensor clusters
+the bridge maps.
+"""
+
+import base64
+import random
+from typing import Any, Dict, List
+
+
+def make_node(node_id: int, extra_attributes: int = 120) -> Dict[str, Any]:
+    """Build one node dict with a realistic attribute tree."""
+    eui64 = base64.b64encode(node_id.to_bytes(8, 'big')).decode()
+    attributes: Dict[str, Any] = {
+        # Descriptor (endpoint 0 and 1)
+        "0/29/0": [{"0": 22, "1": 1}],
+        "0/29/1": [29, 31, 40, 48, 49, 51, 53, 60, 62, 63],
+        "1/29/0": [{"0": 770, "1": 1}, {"0": 775, "1": 1}],
+        "1/29/1": [3, 29, 1026, 1029, 1037, 1066, 91],
+        # Basic Information
+        "0/40/1": "IKEA of Sweden",
+        "0/40/3": "ALPSTUGA air quality monitor",
+        "0/40/5": f"sensor_{node_id}",
+        "0/40/10": "1.0.12",
+        # General Diagnostics / NetworkInterfaces
+        "0/51/0": [{"0": "ot", "1": True, "4": eui64, "7": 4}],
+        # Thread Network Diagnostics
+        "0/53/0": 15,
+        "0/53/7": [
+            {"0": random.getrandbits(48), "1": 100, "2": 3, "5": -70, "6": -68}
+            for _ in range(4)
+        ],
+        # Mapped sensor clusters
+        "1/1026/0": random.randint(1800, 2600),
+        "1/1029/0": random.randint(3000, 6000),
+        "1/1037/0": float(random.randint(400, 1500)),
+        "1/1066/0": float(random.randint(1, 40)),
+        "1/91/0": random.randint(1, 6),
+    }
+    for i in range(extra_attributes):
+        attributes[f"0/{0x0100 + i // 16}/{i % 16}"] = random.randint(0, 65535)
+    # Filler clusters are served by endpoint 0 like real vendor clusters
+    attributes["0/29/1"] = attributes["0/29/1"] + sorted({0x0100 + i // 16 for i in range(extra_attributes)})
+    return {
+        "node_id": node_id,
+        "date_commissioned": "2026-02-01T10:00:00",
+        "last_interview": "2026-02-01T10:00:00",
+        "interview_version": 6,
+        "available": True,
+        "is_bridge": False,
+        "attributes": attributes,
+        "attribute_subscriptions": [],
+    }
+
+
+def make_nodes(count: int, extra_attributes: int = 120) -> List[Dict[str, Any]]:
+    """Build a list of nodes numbered from 1."""
+    return [make_node(node_id, extra_attributes) for node_id in range(1, count + 1)]
+
+
+def make_attribute_update(node_id: int, value: Any = None) -> Dict[str, Any]:
+    """Build an attribute_updated event for the temperature attribute."""
+    if value is None:
+        value = random.randint(1800, 2600)
+    return {"event": "attribute_updated", "data": [node_id, "1/1026/0", value]}
@@ -16,24 +16,51 @@ Version: 2.0 (IEEE Address Support)
 """
 
 import asyncio
+import atexit
+import base64
+import binascii
+import bisect
+import cProfile
+import fnmatch
+import gzip
+import heapq
+import itertools
 import json
 import logging
+import logging.handlers
 import os
+import pstats
+import queue
 import signal
+import sqlite3
 import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import paho.mqtt.client as mqtt
 import websockets
 import yaml
 
+try:
+    import orjson
+except ImportError:  # Optional, faster JSON backend
+    orjson = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+# Subsystem loggers, rate limited separately (bridge.log_rate_limits)
+mqtt_logger = logger.getChild('mqtt')
+matter_logger = logger.getChild('matter')
+ingest_logger = logger.getChild('ingest')
+devices_logger = logger.getChild('devices')
 
 # Configuration from environment variables
 MATTER_SERVER_URL = os.getenv('MATTER_SERVER_URL', 'ws://localhost:5580/ws')
@@ -43,82 +70,1836 @@ MQTT_USERNAME = os.getenv('MQTT_USERNAME')
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD')
 MQTT_BASE_TOPIC = os.getenv('MQTT_BASE_TOPIC', 'matter')
 CONFIG_FILE = os.getenv('CONFIG_FILE', '/app/config.yaml')
+JSON_CODEC = os.getenv('JSON_CODEC', 'auto')  # auto, orjson or json
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '0'))  # Profile the first N seconds after startup
+EVENT_LOOP = os.getenv('EVENT_LOOP', 'asyncio')  # asyncio or uvloop
+
+
+class JSONCodec:
+    """JSON encoder/decoder using orjson when installed, else the standard library."""
+    
+    def __init__(self, backend: str = 'auto'):
+        if backend == 'auto':
+            backend = 'orjson' if orjson is not None else 'json'
+        if backend == 'orjson' and orjson is None:
+            logger.warning("JSON_CODEC=orjson but orjson is not installed, using json")
+            backend = 'json'
+        self.backend = backend
+        if backend == 'orjson':
+            self.loads = orjson.loads
+            self.dumps = orjson.dumps
+        else:
+            self.loads = json.loads
+            self.dumps = self._json_dumps
+    
+    @staticmethod
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+    
+    def dumps_str(self, obj: Any) -> str:
+        """Encode to str (websocket text frames)."""
+        return self.dumps(obj).decode('utf-8')
+
+
+codec = JSONCodec(JSON_CODEC)
+
+
+class JSONLogFormatter(logging.Formatter):
+    """One JSON object per log line."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return codec.dumps_str(entry)
+
+
+class LogRateLimiter(logging.Filter):
+    """Drops repetitive log lines per subsystem.
+    
+    Messages are keyed by logger and format string (not the formatted
+    text), so each call site may log at most its subsystem's limit per
+    window. The first line of the next window reports how many were dropped.
+    """
+    
+    def __init__(self, limits: Dict[str, int], window: float = 60.0):
+        super().__init__()
+        self.limits = limits  # Subsystem (logger name suffix) or "default" -> lines per window, 0 = unlimited
+        self.window = window
+        self.counts: Dict[Tuple[str, Any], list] = {}  # (logger, msg) -> [window start, logged, dropped]
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        subsystem = record.name.rpartition('.')[2] if record.name != logger.name else 'bridge'
+        limit = self.limits.get(subsystem, self.limits.get('default', 0))
+        if not limit:
+            return True
+        key = (record.name, record.msg)
+        entry = self.counts.get(key)
+        if entry is None or record.created - entry[0] >= self.window:
+            dropped = entry[2] if entry else 0
+            self.counts[key] = [record.created, 1, 0]
+            if dropped:
+                record.msg = f"{record.msg} [{dropped} similar messages suppressed]"
+            return True
+        if entry[1] < limit:
+            entry[1] += 1
+            return True
+        entry[2] += 1
+        return False
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without formatting them; the listener thread formats and writes.
+    
+    Only records whose arguments are immutable are left unformatted. Any
+    other argument (a dict, a device, an exception) may still be changed by
+    the event loop, so its message is formatted before it is queued.
+    """
+    
+    IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(type(arg) in self.IMMUTABLE_ARGS for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # Tracebacks reference live frames, render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(bridge_config: Dict):
+    """Route all logging through a queue to a writer thread.
+    
+    Uses bridge.log_level, bridge.log_format (text or json) and
+    bridge.log_rate_limits.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+    
+    stream = logging.StreamHandler(sys.stdout)
+    if bridge_config.get('log_format', 'text') == 'json':
+        stream.setFormatter(JSONLogFormatter())
+    else:
+        stream.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    limits = bridge_config.get('log_rate_limits') or {}
+    handler.addFilter(LogRateLimiter({str(name): int(limit or 0) for name, limit in limits.items()}))
+    
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    logger.setLevel(str(bridge_config.get('log_level', 'INFO')).upper())
+    
+    _log_listener = logging.handlers.QueueListener(log_queue, stream)
+    _log_listener.start()
+
+
+@atexit.register
+def _stop_log_listener():
+    """Flush queued log records on exit."""
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
+class AttributeConverter:
+    """Describes how a Matter attribute is published to MQTT."""
+    
+    __slots__ = ('suffix', 'key', 'scale', 'precision', 'unit', 'enum', 'enum_default', 'raw')
+    
+    def __init__(self, suffix: str, key: Optional[str] = None, scale: Optional[float] = None,
+                 precision: Optional[int] = None, unit: Optional[str] = None,
+                 enum: Optional[Dict[Any, str]] = None, enum_default: Optional[str] = None,
+                 raw: bool = False):
+        self.suffix = suffix  # Topic suffix below the device identifier
+        self.key = key or suffix  # Payload key holding the converted value
+        self.scale = scale  # Raw value is divided by this
+        self.precision = precision  # Decimal places, None = no rounding
+        self.unit = unit
+        self.enum = enum  # Raw value -> label
+        self.enum_default = enum_default
+        self.raw = raw  # Publish the bare value instead of a JSON object
+    
+    def convert(self, value: Any) -> Any:
+        """Convert a raw attribute value into an MQTT payload."""
+        if self.enum is not None:
+            label = self.enum.get(value, self.enum_default)
+            if self.raw:
+                return label
+            return {
+                self.key: label,
+                "value": value,
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        
+        # Matter reports null when a measurement is unknown
+        if value is not None:
+            if self.scale is not None:
+                value = value / self.scale
+            if self.precision is not None:
+                value = round(value, self.precision)
+        if self.raw:
+            return value
+        
+        payload = {self.key: value}
+        if self.unit is not None:
+            payload["unit"] = self.unit
+        payload["timestamp"] = datetime.now(timezone.utc).isoformat()
+        return payload
+
+
+AIR_QUALITY_LABELS = {
+    0: "unknown",
+    1: "good",
+    2: "fair",
+    3: "moderate",
+    4: "poor",
+    5: "very_poor",
+    6: "extremely_poor"
+}
+
+ON_OFF_LABELS = {
+    False: "OFF",
+    True: "ON"
+}
+
+# (cluster_id, attribute_id) -> converter
+ATTRIBUTE_CONVERTERS: Dict[Tuple[int, int], AttributeConverter] = {
+    # Temperature Measurement / MeasuredValue (hundredths of degree)
+    (0x0402, 0x0000): AttributeConverter('temperature', scale=100, precision=1, unit='°C'),
+    # Relative Humidity / MeasuredValue (hundredths of percent)
+    (0x0405, 0x0000): AttributeConverter('humidity', scale=100, precision=1, unit='%'),
+    # Air Quality / AirQuality
+    (0x005B, 0x0000): AttributeConverter('air_quality', key='quality',
+                                         enum=AIR_QUALITY_LABELS, enum_default='unknown'),
+    # CO2 Concentration / MeasuredValue
+    (0x040D, 0x0000): AttributeConverter('co2', precision=1, unit='ppm'),
+    # PM2.5 Concentration / MeasuredValue
+    (0x042A, 0x0000): AttributeConverter('pm25', precision=1, unit='µg/m³'),
+    # OnOff / OnOff
+    (0x0006, 0x0000): AttributeConverter('state', enum=ON_OFF_LABELS, enum_default='OFF', raw=True),
+    # Power Configuration / BatteryPercentageRemaining (0-200 scale)
+    (0x0001, 0x0021): AttributeConverter('battery', scale=2, unit='%'),
+}
+
+# cluster_id -> converter applied to every attribute of the cluster
+CLUSTER_CONVERTERS: Dict[int, AttributeConverter] = {
+    # Thread Network Diagnostics
+    0x0034: AttributeConverter('linkquality', raw=True),
+}
+
+ALL_CONVERTERS = tuple(ATTRIBUTE_CONVERTERS.values()) + tuple(CLUSTER_CONVERTERS.values())
+# Topic suffix -> payload key holding the value of converters publishing JSON objects
+CONVERTER_KEYS = {converter.suffix: converter.key for converter in ALL_CONVERTERS if not converter.raw}
+
+# Power Source / BatPercentRemaining, present on battery powered devices
+BATTERY_PERCENT_SUFFIX = "/47/12"
+
+# Descriptor cluster and its ServerList: server cluster IDs of an endpoint
+DESCRIPTOR_CLUSTER_ID = 0x001D
+DESCRIPTOR_SERVER_LIST_SUFFIX = "/29/1"
+# Global AcceptedCommandList attribute of every cluster
+ACCEPTED_COMMAND_LIST_SUFFIX = "/65529"
+
+# MQTT command cluster name -> (cluster_id, command name -> command_id)
+COMMAND_CLUSTERS: Dict[str, Tuple[int, Dict[str, int]]] = {
+    'onoff': (0x0006, {'off': 0x00, 'on': 0x01, 'toggle': 0x02}),
+}
+# (cluster_id, command_id) that must never be resent after a timeout
+NON_IDEMPOTENT_COMMANDS = {(0x0006, 0x02)}  # OnOff / Toggle
+
+# General Diagnostics / NetworkInterfaces (endpoint 0), source of the EUI-64
+NETWORK_INTERFACES_PATH = "0/51/0"
+NETWORK_INTERFACE_HARDWARE_ADDRESS = "4"
+
+
+def normalize_ieee(address: Any) -> str:
+    """Normalize an IEEE address to lowercase '0x'-prefixed hex.
+    
+    YAML reads an unquoted 0x00124b001a2b3c4d as an int, which is formatted
+    back to its 16 hex digits.
+    """
+    if isinstance(address, int) and not isinstance(address, bool):
+        return f"0x{address:016x}"
+    address = str(address).strip().lower()
+    if address.startswith('0x'):
+        address = address[2:]
+    return f"0x{address.replace(':', '')}"
+
+
+class DeviceTopics:
+    """Precomputed MQTT topic strings for one device identifier."""
+    
+    __slots__ = ('identifier', 'prefix', 'availability', 'converters', 'generic', 'endpoints')
+    
+    def __init__(self, identifier: str):
+        self.identifier = identifier
+        self.prefix = f"{MQTT_BASE_TOPIC}/{identifier}"
+        self.availability = f"{self.prefix}/availability"
+        # converter -> full topic
+        self.converters: Dict[AttributeConverter, str] = {
+            converter: f"{self.prefix}/{converter.suffix}" for converter in ALL_CONVERTERS
+        }
+        # (cluster_id, attribute_id) -> full topic, filled as attributes are seen
+        self.generic: Dict[Tuple[int, int], str] = {}
+        # (base topic, endpoint) -> topic of a cluster's non-primary endpoint
+        self.endpoints: Dict[Tuple[str, int], str] = {}
+    
+    def generic_topic(self, cluster_id: int, attribute_id: int) -> str:
+        """Get the generic fallback topic for an unmapped attribute."""
+        key = (cluster_id, attribute_id)
+        topic = self.generic.get(key)
+        if topic is None:
+            topic = f"{self.prefix}/cluster_{cluster_id:04x}/attr_{attribute_id:04x}"
+            self.generic[key] = topic
+        return topic
+    
+    def endpoint_topic(self, topic: str, endpoint_id: int) -> str:
+        """Topic for the same attribute on another endpoint, e.g. state_2."""
+        key = (topic, endpoint_id)
+        endpoint_topic = self.endpoints.get(key)
+        if endpoint_topic is None:
+            endpoint_topic = f"{topic}_{endpoint_id}"
+            self.endpoints[key] = endpoint_topic
+        return endpoint_topic
+
+
+class CapabilityIndex:
+    """Endpoints and server clusters of every node, from the Descriptor cluster.
+    
+    Built from a node's attribute tree when it is registered and updated
+    when a Descriptor ServerList or AcceptedCommandList attribute changes.
+    Nodes without Descriptor data are unknown and every lookup answers
+    None, so callers keep their previous behaviour for them.
+    """
+    
+    def __init__(self):
+        # node_id -> endpoint -> server cluster IDs
+        self.servers: Dict[int, Dict[int, frozenset]] = {}
+        # node_id -> cluster_id -> endpoints serving it, ascending
+        self.clusters: Dict[int, Dict[int, Tuple[int, ...]]] = {}
+        # node_id -> (endpoint, cluster_id) -> accepted command IDs
+        self.commands: Dict[int, Dict[Tuple[int, int], frozenset]] = {}
+    
+    def build(self, node_id: int, attributes: Dict):
+        """Index a node from its full attribute tree."""
+        self.forget(node_id)
+        for path, value in attributes.items():
+            self.update(node_id, path, value, reindex=False)
+        self._reindex(node_id)
+    
+    def update(self, node_id: int, path: str, value: Any, reindex: bool = True):
+        """Apply one attribute report if it describes endpoints or commands."""
+        if path.endswith(DESCRIPTOR_SERVER_LIST_SUFFIX):
+            if not isinstance(value, list):
+                return
+            endpoint_id = int(path.split('/', 1)[0])
+            self.servers.setdefault(node_id, {})[endpoint_id] = frozenset(
+                cluster for cluster in value if isinstance(cluster, int))
+            if reindex:
+                self._reindex(node_id)
+        elif path.endswith(ACCEPTED_COMMAND_LIST_SUFFIX):
+            if not isinstance(value, list):
+                return
+            endpoint_id, cluster_id, _ = (int(part) for part in path.split('/'))
+            self.commands.setdefault(node_id, {})[(endpoint_id, cluster_id)] = frozenset(
+                command for command in value if isinstance(command, int))
+    
+    def _reindex(self, node_id: int):
+        """Rebuild the cluster -> endpoints lookup of a node."""
+        servers = self.servers.get(node_id)
+        if not servers:
+            return
+        clusters: Dict[int, List[int]] = {}
+        for endpoint_id in sorted(servers):
+            for cluster_id in servers[endpoint_id]:
+                clusters.setdefault(cluster_id, []).append(endpoint_id)
+        self.clusters[node_id] = {cluster_id: tuple(endpoints) for cluster_id, endpoints in clusters.items()}
+    
+    def forget(self, node_id: int):
+        """Drop a node from the index."""
+        self.servers.pop(node_id, None)
+        self.clusters.pop(node_id, None)
+        self.commands.pop(node_id, None)
+    
+    def endpoints(self, node_id: int, cluster_id: int) -> Optional[Tuple[int, ...]]:
+        """Endpoints serving a cluster (lowest first), None if the node is unknown."""
+        clusters = self.clusters.get(node_id)
+        if clusters is None:
+            return None
+        return clusters.get(cluster_id, ())
+    
+    def accepts(self, node_id: int, endpoint_id: int, cluster_id: int, command_id: int) -> Optional[bool]:
+        """Whether an endpoint accepts a command, None if its command list is unknown."""
+        accepted = self.commands.get(node_id, {}).get((endpoint_id, cluster_id))
+        if accepted is None:
+            return None
+        return command_id in accepted
+
+
+class DeviceRegistry:
+    """Registry for mapping between node IDs and friendly names."""
+    
+    def __init__(self, config: Dict):
+        self.config = config
+        self.devices: Dict[int, Dict] = {}  # node_id -> device info
+        self.by_friendly_name: Dict[str, int] = {}  # friendly_name -> node_id
+        self.by_ieee: Dict[str, int] = {}  # normalized IEEE address -> node_id
+        # Topics for nodes that report before they are registered
+        self._unregistered_topics: Dict[int, DeviceTopics] = {}
+        self.unsaved: set = set()  # node_ids changed since the last state checkpoint
+        self.capabilities = CapabilityIndex()
+        # Membership, name or availability changed since bridge/info was published
+        self.info_dirty = True
+        self.changes: List[Dict] = []  # Pending bridge/devices/delta entries
+        
+    def _record_change(self, change: str, device: Dict):
+        """Flag bridge/info for republishing and queue a delta entry."""
+        self.info_dirty = True
+        self.changes.append({
+            "change": change,
+            "node_id": device['node_id'],
+            "friendly_name": device['friendly_name'],
+            "available": device['available']
+        })
+    
+    def take_changes(self) -> List[Dict]:
+        """Return and clear the pending delta entries."""
+        changes, self.changes = self.changes, []
+        return changes
+        
+    def register_device(self, node_id: int, info: Dict = None, available: bool = True,
+                        generation: int = 0):
+        """Register a device with its node ID."""
+        info = info or {}
+        friendly_name = self._get_friendly_name(node_id)
+        device_info = {
+            'node_id': node_id,
+            'friendly_name': friendly_name,
+            'ieee_address': self._get_ieee_address(node_id, info),
+            'topics': self._get_cached_topics(node_id, friendly_name),
+            'last_seen': datetime.now(timezone.utc),
+            'available': available,
+            'generation': generation,  # Sync generation that last saw the node
+            'info': info
+        }
+        
+        previous = self.devices.get(node_id)
+        self._unindex_device(node_id)
+        self.devices[node_id] = device_info
+        self._index_device(device_info)
+        self.capabilities.build(node_id, info.get('attributes') or {})
+        self.unsaved.add(node_id)
+        if previous is None:
+            self._record_change("added", device_info)
+        elif previous['friendly_name'] != friendly_name:
+            self._record_change("renamed", device_info)
+        elif previous['available'] != available:
+            self._record_change("availability", device_info)
+        elif previous['ieee_address'] != device_info['ieee_address']:
+            self.info_dirty = True
+        devices_logger.log(logging.INFO if previous is None else logging.DEBUG,
+                           "Registered device: node %s as '%s'", node_id, device_info['friendly_name'])
+    
+    def remove_device(self, node_id: int) -> Optional[Dict]:
+        """Remove a device and drop it from the lookup indexes."""
+        self._unindex_device(node_id)
+        self._unregistered_topics.pop(node_id, None)
+        self.unsaved.add(node_id)
+        self.capabilities.forget(node_id)
+        device = self.devices.pop(node_id, None)
+        if device is not None:
+            self._record_change("removed", device)
+        return device
+        
+    def _get_friendly_name(self, node_id: int) -> str:
+        """Get friendly name from config or use node_id."""
+        device_config = self.config.get('devices', {}).get(node_id, {})
+        return device_config.get('friendly_name', f"node_{node_id}")
+    
+    def _get_ieee_address(self, node_id: int, info: Dict) -> Optional[str]:
+        """Get IEEE address from config or the node's network interfaces."""
+        device_config = self.config.get('devices', {}).get(node_id, {})
+        if device_config.get('ieee_address'):
+            return normalize_ieee(device_config['ieee_address'])
+        
+        interfaces = info.get('attributes', {}).get(NETWORK_INTERFACES_PATH) or []
+        for interface in interfaces:
+            if not isinstance(interface, dict):
+                continue
+            hardware_address = interface.get(NETWORK_INTERFACE_HARDWARE_ADDRESS)
+            if not hardware_address:
+                continue
+            try:
+                raw = base64.b64decode(hardware_address)
+            except (binascii.Error, TypeError, ValueError):
+                continue
+            if len(raw) == 8:  # EUI-64 (Thread)
+                return f"0x{raw.hex()}"
+        return None
+    
+    def _index_device(self, device: Dict):
+        """Add a device to the reverse lookup indexes."""
+        self.by_friendly_name[device['friendly_name']] = device['node_id']
+        if device['ieee_address']:
+            self.by_ieee[device['ieee_address']] = device['node_id']
+    
+    def _unindex_device(self, node_id: int):
+        """Remove a device from the reverse lookup indexes."""
+        device = self.devices.get(node_id)
+        if not device:
+            return
+        if self.by_friendly_name.get(device['friendly_name']) == node_id:
+            del self.by_friendly_name[device['friendly_name']]
+        if device['ieee_address'] and self.by_ieee.get(device['ieee_address']) == node_id:
+            del self.by_ieee[device['ieee_address']]
+    
+    def _get_cached_topics(self, node_id: int, friendly_name: str) -> DeviceTopics:
+        """Reuse already built topics unless the friendly name differs.
+        
+        This is where a rename takes effect: the name comes from the device
+        config, and register_device rebuilds the topics when it changed.
+        """
+        device = self.devices.get(node_id)
+        topics = device['topics'] if device else self._unregistered_topics.pop(node_id, None)
+        if topics is None or topics.identifier != friendly_name:
+            topics = DeviceTopics(friendly_name)
+        return topics
+    
+    def get_device_by_node_id(self, node_id: int) -> Optional[Dict]:
+        """Get device info by node ID."""
+        return self.devices.get(node_id)
+    
+    def get_device_by_ieee(self, ieee_address: str) -> Optional[Dict]:
+        """Get device info by IEEE address."""
+        node_id = self.by_ieee.get(normalize_ieee(ieee_address))
+        return self.devices.get(node_id) if node_id is not None else None
+    
+    def get_device_by_friendly_name(self, friendly_name: str) -> Optional[Dict]:
+        """Get device info by friendly name."""
+        node_id = self.by_friendly_name.get(friendly_name)
+        return self.devices.get(node_id) if node_id is not None else None
+    
+    def get_topics(self, node_id: int) -> DeviceTopics:
+        """Get precomputed topics for a node (registered or not)."""
+        device = self.devices.get(node_id)
+        if device:
+            return device['topics']
+        
+        # Not yet registered, build once from config
+        topics = self._unregistered_topics.get(node_id)
+        if topics is None:
+            topics = DeviceTopics(self._get_friendly_name(node_id))
+            self._unregistered_topics[node_id] = topics
+        return topics
+    
+    def get_topic_identifier(self, node_id: int) -> str:
+        """Get topic identifier (friendly name or node_id)."""
+        return self.get_topics(node_id).identifier
+    
+    def get_attributes(self, node_id: int) -> Optional[Dict]:
+        """Get the last known attribute values of a node ("endpoint/cluster/attribute" -> value)."""
+        device = self.devices.get(node_id)
+        return device['info'].get('attributes') if device else None
+    
+    def update_attribute(self, node_id: int, attr_path: str, value: Any):
+        """Record a reported attribute value."""
+        device = self.devices.get(node_id)
+        if device:
+            device['info'].setdefault('attributes', {})[attr_path] = value
+            self.unsaved.add(node_id)
+            self.capabilities.update(node_id, attr_path, value)
+    
+    def update_availability(self, node_id: int, available: bool):
+        """Update device availability."""
+        device = self.devices.get(node_id)
+        if device:
+            changed = device['available'] != available
+            device['available'] = available
+            if available:
+                device['last_seen'] = datetime.now(timezone.utc)
+            self.unsaved.add(node_id)
+            if changed:
+                self._record_change("availability", device)
+
+
+class ChangeFilter:
+    """Last-value cache that suppresses unchanged or in-deadband publishes."""
+    
+    def __init__(self, config: Dict):
+        self.enabled = bool(config.get('enabled', False))
+        self.heartbeat = float(config.get('heartbeat', 900) or 0)  # 0 = never force
+        # topic suffix (converter) -> (absolute, percent)
+        self.deadbands: Dict[str, Tuple[float, float]] = {}
+        for suffix, band in (config.get('deadbands') or {}).items():
+            band = band or {}
+            self.deadbands[str(suffix)] = (
+                float(band.get('absolute', 0) or 0),
+                float(band.get('percent', 0) or 0)
+            )
+        # topic -> [last published value, monotonic publish time, deadband]
+        self.last_values: Dict[str, list] = {}
+        # topic -> converter payload key, None for generic topics
+        self.value_keys: Dict[str, Optional[str]] = {}
+        self.suppressed = 0
+    
+    @staticmethod
+    def _suffixes(topic: str) -> Tuple[str, Optional[str]]:
+        """Topic suffix, and for state_2 style endpoint topics the base suffix."""
+        suffix = topic.rsplit('/', 1)[-1]
+        base, _, endpoint = suffix.rpartition('_')
+        return suffix, (base if base and endpoint.isdigit() else None)
+    
+    def comparable(self, topic: str, payload: Any) -> Any:
+        """Extract the value to compare, ignoring timestamps.
+        
+        Converter payloads are compared by their value key only; any other
+        JSON object (struct-valued generic attributes) is compared whole.
+        """
+        if not isinstance(payload, dict):
+            return payload
+        if topic in self.value_keys:
+            key = self.value_keys[topic]
+        else:
+            suffix, base = self._suffixes(topic)
+            key = CONVERTER_KEYS.get(suffix) or (CONVERTER_KEYS.get(base) if base else None)
+            self.value_keys[topic] = key
+        if key is not None and key in payload:
+            return payload[key]
+        return {field: value for field, value in payload.items() if field != 'timestamp'}
+    
+    def _deadband(self, topic: str) -> Tuple[float, float]:
+        """Deadband of a topic suffix; state_2 falls back to the one of state."""
+        suffix, base = self._suffixes(topic)
+        deadband = self.deadbands.get(suffix)
+        if deadband is None and base:
+            deadband = self.deadbands.get(base)
+        return deadband or (0.0, 0.0)
+    
+    def forget(self, topic: str):
+        """Drop a topic's cached value, e.g. after the message was never published."""
+        self.last_values.pop(topic, None)
+    
+    def seed(self, topic: str, value: Any):
+        """Prime the cache with a value published before a restart."""
+        if self.enabled:
+            self.last_values[topic] = [value, time.monotonic(), self._deadband(topic)]
+    
+    def should_publish(self, topic: str, payload: Any) -> bool:
+        """Check a payload against the cache and record it if it goes out."""
+        if not self.enabled:
+            return True
+        
+        value = self.comparable(topic, payload)
+        now = time.monotonic()
+        entry = self.last_values.get(topic)
+        if entry is None:
+            self.last_values[topic] = [value, now, self._deadband(topic)]
+            return True
+        
+        last_value, last_time, (absolute, percent) = entry
+        if self.heartbeat and now - last_time >= self.heartbeat:
+            changed = True
+        elif (isinstance(value, (int, float)) and isinstance(last_value, (int, float))
+                and not isinstance(value, bool) and not isinstance(last_value, bool)):
+            limit = max(absolute, abs(last_value) * percent / 100.0)
+            changed = abs(value - last_value) > limit
+        else:
+            changed = value != last_value
+        
+        if not changed:
+            self.suppressed += 1
+            return False
+        
+        entry[0] = value
+        entry[1] = now
+        return True
+
+
+class AttributeFilter:
+    """Global and per-device allow/deny rules for publishing attributes.
+    
+    A rule is an "endpoint/cluster/attribute" path with * wildcards, a bare
+    cluster ID or a [cluster, attribute] pair; IDs may be hex ("0x001D").
+    Rules are compiled into one set per wildcard shape and every decision is
+    cached per (node_id, path), so after an attribute's first report the
+    check is a single dict lookup.
+    
+    Device rules win: a device deny drops, a device allow publishes. Then a
+    global deny drops, and a non-empty global allow list publishes only what
+    it matches. Everything else is published.
+    """
+    
+    def __init__(self, config: Dict, devices: Dict):
+        self.allow, self.deny = self._compile(config)
+        # node_id -> (allow, deny)
+        self.devices: Dict[int, Tuple[Dict, Dict]] = {
+            node_id: self._compile(device['attribute_filter'])
+            for node_id, device in devices.items()
+            if isinstance(device, dict) and device.get('attribute_filter')
+        }
+        self.decisions: Dict[Tuple[int, str], bool] = {}  # (node_id, path) -> publish
+    
+    @staticmethod
+    def _rule_id(value: Any) -> Optional[int]:
+        if isinstance(value, str):
+            value = value.strip()
+            return None if value == '*' else int(value, 0)
+        return int(value)
+    
+    @classmethod
+    def _parse_rule(cls, rule: Any) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+        """Turn a rule into (endpoint, cluster, attribute), None = any."""
+        try:
+            if isinstance(rule, (list, tuple)) and len(rule) == 2:
+                return (None, cls._rule_id(rule[0]), cls._rule_id(rule[1]))
+            if isinstance(rule, str) and '/' in rule:
+                parts = rule.split('/')
+                if len(parts) == 3:
+                    return tuple(cls._rule_id(part) for part in parts)
+            elif isinstance(rule, (int, str)) and not isinstance(rule, bool):
+                return (None, cls._rule_id(rule), None)
+        except ValueError:
+            pass
+        raise ValueError(f"Invalid attribute filter rule: {rule!r}")
+    
+    @classmethod
+    def _compile(cls, config: Dict) -> Tuple[Dict, Dict]:
+        """Compile allow and deny lists into {shape: set of keys}."""
+        compiled = []
+        for name in ('allow', 'deny'):
+            rules: Dict[Tuple[bool, bool, bool], set] = {}
+            for rule in config.get(name) or ():
+                parsed = cls._parse_rule(rule)
+                shape = tuple(part is not None for part in parsed)
+                rules.setdefault(shape, set()).add(tuple(part for part in parsed if part is not None))
+            compiled.append(rules)
+        return compiled[0], compiled[1]
+    
+    @staticmethod
+    def _matches(rules: Dict, ids: Tuple[int, int, int]) -> bool:
+        for shape, keys in rules.items():
+            if tuple(part for part, fixed in zip(ids, shape) if fixed) in keys:
+                return True
+        return False
+    
+    def allows(self, node_id: int, path: str) -> bool:
+        """Whether an attribute ("endpoint/cluster/attribute") of a node is published."""
+        key = (node_id, path)
+        decision = self.decisions.get(key)
+        if decision is None:
+            try:
+                ids = tuple(int(part) for part in path.split('/'))
+            except ValueError:
+                return True  # Incomplete path, left to the mapping
+            decision = self._decide(node_id, ids)
+            self.decisions[key] = decision
+        return decision
+    
+    def _decide(self, node_id: int, ids: Tuple[int, int, int]) -> bool:
+        device_rules = self.devices.get(node_id)
+        if device_rules is not None:
+            allow, deny = device_rules
+            if self._matches(deny, ids):
+                return False
+            if self._matches(allow, ids):
+                return True
+        if self._matches(self.deny, ids):
+            return False
+        return not self.allow or self._matches(self.allow, ids)
+
+
+class AvailabilityWatchdog:
+    """Per-node silence deadlines on a monotonic clock, kept in a min-heap.
+    
+    touch() only moves the node's deadline (O(1)); a heap entry that surfaces
+    with an outdated deadline is pushed back with the current one, so each
+    node has at most one live heap entry and nothing scans all nodes.
+    """
+    
+    def __init__(self, on_expire: Callable[[int], Awaitable[None]], default_timeout: float = 300):
+        self.on_expire = on_expire
+        self.default_timeout = default_timeout  # 0 = never expire
+        self.timeouts: Dict[int, float] = {}  # node_id -> timeout override
+        self.deadlines: Dict[int, list] = {}  # node_id -> [deadline, token]
+        self.heap: List[Tuple[float, int, int]] = []  # (deadline, token, node_id)
+        self.tokens = itertools.count()
+        self.wakeup = asyncio.Event()
+    
+    def set_timeout(self, node_id: int, timeout: float):
+        """Set a node's timeout (applies from its next touch)."""
+        self.timeouts[node_id] = timeout
+    
+    def touch(self, node_id: int):
+        """Push a node's deadline out after it was heard from."""
+        timeout = self.timeouts.get(node_id, self.default_timeout)
+        if not timeout:
+            return
+        deadline = time.monotonic() + timeout
+        entry = self.deadlines.get(node_id)
+        if entry is not None:
+            entry[0] = deadline  # Heap entry is refreshed lazily
+            return
+        token = next(self.tokens)
+        self.deadlines[node_id] = [deadline, token]
+        heapq.heappush(self.heap, (deadline, token, node_id))
+        if self.heap[0][1] == token:
+            self.wakeup.set()  # New earliest deadline
+    
+    def forget(self, node_id: int):
+        """Stop watching a node until it is touched again."""
+        self.deadlines.pop(node_id, None)
+    
+    async def run(self):
+        """Expire nodes whose deadline has passed."""
+        while True:
+            if not self.heap:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            
+            deadline, token, node_id = self.heap[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            
+            heapq.heappop(self.heap)
+            entry = self.deadlines.get(node_id)
+            if entry is None or entry[1] != token:
+                continue  # Forgotten or superseded
+            if entry[0] > deadline:
+                heapq.heappush(self.heap, (entry[0], token, node_id))
+                continue
+            del self.deadlines[node_id]
+            try:
+                await self.on_expire(node_id)
+            except Exception as e:
+                devices_logger.error("Error expiring node %s: %s", node_id, e)
+
+
+class StateStore:
+    """SQLite checkpoint of the device registry and published values.
+    
+    Lets the bridge start with its devices, attribute state and the set of
+    retained topics it owns before the Matter server has answered.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS devices (
+            node_id INTEGER PRIMARY KEY,
+            available INTEGER NOT NULL,
+            last_seen TEXT,
+            info BLOB
+        );
+        CREATE TABLE IF NOT EXISTS published (
+            topic TEXT PRIMARY KEY,
+            value BLOB
+        );
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()  # Checkpoints run in a worker thread
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+    
+    def load(self) -> Tuple[List[Tuple], List[Tuple]]:
+        """Load (node_id, available, last_seen, info) rows and (topic, value) rows."""
+        with self.lock:
+            devices = self.db.execute(
+                "SELECT node_id, available, last_seen, info FROM devices"
+            ).fetchall()
+            published = self.db.execute("SELECT topic, value FROM published").fetchall()
+        return devices, published
+    
+    def save(self, devices: List[Tuple], removed: List[int], published: List[Tuple]):
+        """Write changed devices and published values in one transaction.
+        
+        A published value of None deletes the topic's row.
+        """
+        with self.lock, self.db:
+            if removed:
+                self.db.executemany("DELETE FROM devices WHERE node_id = ?",
+                                    [(node_id,) for node_id in removed])
+            if devices:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO devices (node_id, available, last_seen, info) "
+                    "VALUES (?, ?, ?, ?)", devices
+                )
+            if published:
+                self.db.executemany("DELETE FROM published WHERE topic = ?",
+                                    [(topic,) for topic, value in published if value is None])
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO published (topic, value) VALUES (?, ?)",
+                    [row for row in published if row[1] is not None]
+                )
+    
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.db.close()
+
+
+class FrameCapture:
+    """Append-only log of raw Matter server frames for later replay.
+    
+    One line per frame: milliseconds since the capture started, a tab and
+    the frame text. Paths ending in .gz are gzip compressed.
+    """
+    
+    HEADER = "# matter-capture 1"
+    
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        opener = gzip.open if path.endswith('.gz') else open
+        self.file = opener(path, 'at', encoding='utf-8')
+        self.start = time.monotonic()
+        self.frames = 0
+        self.file.write(f"{self.HEADER} started={datetime.now(timezone.utc).isoformat()}\n")
+    
+    def write(self, frame: Any):
+        """Record one frame."""
+        if isinstance(frame, bytes):
+            frame = frame.decode('utf-8')
+        offset_ms = (time.monotonic() - self.start) * 1000
+        # Raw newlines in JSON can only be whitespace between tokens
+        self.file.write(f"{offset_ms:.1f}\t{frame.replace(chr(10), ' ')}\n")
+        self.frames += 1
+    
+    def close(self):
+        """Flush and close the log."""
+        self.file.close()
+    
+    @staticmethod
+    def read(path: str):
+        """Yield (seconds since capture start, frame) from a capture file.
+        
+        Appended sessions restart their offsets; they are replayed back to back.
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        base = last = 0.0
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#'):
+                    base = last
+                    continue
+                offset_ms, _, frame = line.rstrip('\n').partition('\t')
+                last = base + float(offset_ms) / 1000
+                yield last, frame
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed bucket bounds (seconds)."""
+    
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        """Record one observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding quantile q (last bound for +Inf)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+    
+    def summary(self) -> Dict:
+        """Count, mean and approximate percentiles in milliseconds."""
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": self.quantile(0.50) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000
+        }
+    
+    def prometheus(self, name: str, labels: str = "") -> List[str]:
+        """Render as Prometheus text exposition lines."""
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class BridgeMetrics:
+    """Counters and histograms for bridge/stats and the /metrics endpoint."""
+    
+    RTT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    LOOP_LAG_WINDOW = 1000  # Recent samples used for exact loop lag percentiles
+    
+    def __init__(self):
+        self.messages: Dict[str, int] = {}  # Matter event type (or "response") -> count
+        self.publishes: Dict[str, int] = {}  # Topic class -> count
+        self.mappings: Dict[str, int] = {}  # Converter key (or "generic") -> count
+        self.connections = {"matter": 0, "mqtt": 0}
+        self.slow_handlers: Dict[str, int] = {}  # Event type -> handlers over the threshold
+        self.command_rtt = Histogram(self.RTT_BUCKETS)
+        self.loop_lag = Histogram()
+        self.loop_lag_samples: deque = deque(maxlen=self.LOOP_LAG_WINDOW)
+        self.loop_stalls = 0  # Lag over the stall threshold
+        self.node_sync_failures = 0  # per_node get_node requests that failed or timed out
+    
+    def count_message(self, event_type: str):
+        """Count a Matter frame by event type."""
+        self.messages[event_type] = self.messages.get(event_type, 0) + 1
+    
+    def count_publish(self, topic_class: str):
+        """Count an MQTT publish by topic class."""
+        self.publishes[topic_class] = self.publishes.get(topic_class, 0) + 1
+    
+    def count_mapping(self, converter_key: str):
+        """Count an attribute mapped by a converter or the generic fallback."""
+        self.mappings[converter_key] = self.mappings.get(converter_key, 0) + 1
+    
+    def count_slow_handler(self, event_type: str):
+        """Count a handler that exceeded the slow handler threshold."""
+        self.slow_handlers[event_type] = self.slow_handlers.get(event_type, 0) + 1
+    
+    def observe_loop_lag(self, lag: float):
+        """Record one event loop lag sample (seconds)."""
+        self.loop_lag.observe(lag)
+        self.loop_lag_samples.append(lag)
+    
+    def loop_lag_summary(self) -> Dict:
+        """Percentiles of the recent loop lag samples in milliseconds."""
+        samples = sorted(self.loop_lag_samples)
+        if not samples:
+            return {"samples": 0, "stalls": self.loop_stalls}
+        last = len(samples) - 1
+        return {
+            "samples": len(samples),
+            "p50_ms": round(samples[int(last * 0.50)] * 1000, 2),
+            "p95_ms": round(samples[int(last * 0.95)] * 1000, 2),
+            "p99_ms": round(samples[int(last * 0.99)] * 1000, 2),
+            "max_ms": round(samples[-1] * 1000, 2),
+            "stalls": self.loop_stalls
+        }
+    
+    def summary(self, ingest: 'IngestPipeline') -> Dict:
+        """JSON document for bridge/stats."""
+        summary = {
+            "messages": dict(self.messages),
+            "publishes": dict(self.publishes),
+            "mappings": dict(self.mappings),
+            "connections": dict(self.connections),
+            "slow_handlers": dict(self.slow_handlers),
+            "node_sync_failures": self.node_sync_failures,
+            "ingest_latency": ingest.latency.summary(),
+            "command_rtt": self.command_rtt.summary(),
+            "loop_lag": self.loop_lag_summary()
+        }
+        return summary
+    
+    def prometheus(self, ingest: 'IngestPipeline', outbound: 'OutboundQueue',
+                   snapshot: 'SnapshotBacklog') -> str:
+        """Prometheus text exposition of all metrics."""
+        lines = ["# TYPE matter_bridge_messages_total counter"]
+        lines += [f'matter_bridge_messages_total{{type="{key}"}} {value}'
+                  for key, value in self.messages.items()]
+        lines.append("# TYPE matter_bridge_publishes_total counter")
+        lines += [f'matter_bridge_publishes_total{{class="{key}"}} {value}'
+                  for key, value in self.publishes.items()]
+        lines.append("# TYPE matter_bridge_attribute_mappings_total counter")
+        lines += [f'matter_bridge_attribute_mappings_total{{converter="{key}"}} {value}'
+                  for key, value in self.mappings.items()]
+        lines.append("# TYPE matter_bridge_connections_total counter")
+        lines += [f'matter_bridge_connections_total{{peer="{key}"}} {value}'
+                  for key, value in self.connections.items()]
+        lines.append("# TYPE matter_bridge_loop_stalls_total counter")
+        lines.append(f"matter_bridge_loop_stalls_total {self.loop_stalls}")
+        lines.append("# TYPE matter_bridge_node_sync_failures_total counter")
+        lines.append(f"matter_bridge_node_sync_failures_total {self.node_sync_failures}")
+        lines.append("# TYPE matter_bridge_slow_handlers_total counter")
+        lines += [f'matter_bridge_slow_handlers_total{{type="{key}"}} {value}'
+                  for key, value in self.slow_handlers.items()]
+        
+        lines.append("# TYPE matter_bridge_queue_depth gauge")
+        lines.append(f'matter_bridge_queue_depth{{queue="frames"}} {ingest.frames.qsize()}')
+        lines.append(f'matter_bridge_queue_depth{{queue="snapshot"}} {len(snapshot)}')
+        for index, shard in enumerate(ingest.shards):
+            lines.append(f'matter_bridge_queue_depth{{queue="shard{index}"}} {shard.qsize()}')
+        lines.append("# TYPE matter_bridge_outbound_queue_messages gauge")
+        lines += [f'matter_bridge_outbound_queue_messages{{class="{name}"}} {len(queue)}'
+                  for name, queue in outbound.queues.items()]
+        lines.append("# TYPE matter_bridge_outbound_queue_bytes gauge")
+        lines.append(f"matter_bridge_outbound_queue_bytes {outbound.bytes}")
+        lines.append("# TYPE matter_bridge_outbound_dropped_total counter")
+        lines += [f'matter_bridge_outbound_dropped_total{{class="{name}"}} {count}'
+                  for name, count in outbound.drops.items()]
+        lines.append("# TYPE matter_bridge_outbound_replaced_total counter")
+        lines += [f'matter_bridge_outbound_replaced_total{{class="{name}"}} {count}'
+                  for name, count in outbound.replaced.items()]
+        lines.append("# TYPE matter_bridge_ingest_processed_total counter")
+        lines.append(f"matter_bridge_ingest_processed_total {ingest.processed}")
+        lines.append("# TYPE matter_bridge_ingest_conflated_total counter")
+        lines.append(f"matter_bridge_ingest_conflated_total {ingest.conflated}")
+        
+        for name, histogram in (("matter_bridge_ingest_latency_seconds", ingest.latency),
+                                ("matter_bridge_outbound_wait_seconds", outbound.wait),
+                                ("matter_bridge_command_rtt_seconds", self.command_rtt),
+                                ("matter_bridge_loop_lag_seconds", self.loop_lag)):
+            lines.append(f"# TYPE {name} histogram")
+            lines += histogram.prometheus(name)
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and samples the stack of stalls.
+    
+    A task sleeps for interval and records how late it wakes up. A watcher
+    thread checks when that wake-up is overdue by more than the threshold
+    and logs the loop thread's current stack, which is the callback or
+    coroutine blocking the loop.
+    """
+    
+    def __init__(self, metrics: BridgeMetrics, interval: float = 0.5, threshold: float = 0.25):
+        self.metrics = metrics
+        self.interval = interval
+        self.threshold = threshold  # 0 = no stack sampling
+        self.expected = 0.0  # time.monotonic() the task should wake up at
+        self.reported = False  # Stack already logged for the current stall
+        self.loop_thread: Optional[int] = None
+        self.running = False
+    
+    async def run(self):
+        """Sample lag until stopped."""
+        self.running = True
+        self.loop_thread = threading.get_ident()
+        if self.threshold > 0:
+            threading.Thread(target=self._watch, name="loop-lag-watch", daemon=True).start()
+        while self.running:
+            self.expected = time.monotonic() + self.interval
+            self.reported = False
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self.expected)
+            self.metrics.observe_loop_lag(lag)
+            if lag > self.threshold > 0:
+                self.metrics.loop_stalls += 1
+    
+    def _watch(self):
+        """Watcher thread: log the loop thread's stack while it is stalled."""
+        period = min(self.threshold / 2, self.interval)
+        while self.running:
+            time.sleep(period)
+            overdue = time.monotonic() - self.expected
+            if overdue <= self.threshold or self.reported:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            self.reported = True
+            stack = ''.join(traceback.format_stack(frame))
+            logger.warning("Event loop blocked for %.0f ms, loop thread stack:\n%s", overdue * 1000, stack)
+    
+    def stop(self):
+        """Stop sampling."""
+        self.running = False
+
+
+class HotPathProfiler:
+    """Deterministic profile of the event loop thread for a bounded window.
+    
+    Everything on the loop (message handling, mapping, publishing) runs in
+    the main thread, so one cProfile window covers the whole hot path. The
+    profile is written to a .prof file for pstats / snakeviz.
+    """
+    
+    # Functions summarised in the log when a window ends
+    HOT_PATH = ('handle_matter_message', 'handle_matter_event', 'handle_attribute_update',
+                'map_attribute_to_mqtt', 'publish_node_attributes', 'route_matter_message')
+    
+    def __init__(self, directory: str, max_seconds: float):
+        self.directory = directory
+        self.max_seconds = max_seconds
+        self.profile: Optional[cProfile.Profile] = None
+        self.path: Optional[str] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+    
+    def start(self, seconds: float) -> Optional[str]:
+        """Start a window on the running loop. Returns the output path, None if already running."""
+        if self.profile is not None:
+            return None
+        seconds = max(0.1, min(seconds, self.max_seconds))
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        self.path = os.path.join(self.directory, f"profile-{stamp}.prof")
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+        logger.info("Profiling for %.0fs, writing %s", seconds, self.path)
+        return self.path
+    
+    def stop(self):
+        """End the window and write the profile."""
+        if self.profile is None:
+            return
+        profile, self.profile = self.profile, None
+        profile.disable()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        try:
+            profile.dump_stats(self.path)
+        except OSError as e:
+            logger.error("Error writing profile %s: %s", self.path, e)
+            return
+        stats = pstats.Stats(profile).stats
+        for (_, _, function), (_, calls, _, cumulative, _) in stats.items():
+            if function in self.HOT_PATH:
+                logger.info("Profile %s: %s calls, %.1f ms cumulative", function, calls, cumulative * 1000)
+        logger.info("Profile written to %s", self.path)
+
+
+class MatterRequestError(Exception):
+    """Error response returned by the Matter server."""
+    
+    def __init__(self, command: str, error_code: Any, details: Any):
+        super().__init__(f"{command} failed with error {error_code}: {details}")
+        self.command = command
+        self.error_code = error_code
+        self.details = details
+
+
+class MatterRequestTracker:
+    """Correlates Matter server responses with requests by message_id."""
+    
+    def __init__(self, timeout: float = 30.0, max_in_flight: int = 8):
+        self.timeout = timeout
+        self.message_id = 0
+        self.pending: Dict[str, Tuple[str, asyncio.Future]] = {}  # message_id -> (command, future)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+    
+    async def request(self, ws_client, command: str, args: Optional[Dict] = None,
+                      timeout: Optional[float] = None) -> Any:
+        """Send a command and wait for its result."""
+        async with self.in_flight:
+            self.message_id += 1
+            message_id = str(self.message_id)
+            message = {"message_id": message_id, "command": command}
+            if args is not None:
+                message["args"] = args
+            
+            future = asyncio.get_running_loop().create_future()
+            self.pending[message_id] = (command, future)
+            try:
+                await ws_client.send(codec.dumps_str(message))
+                return await asyncio.wait_for(future, timeout or self.timeout)
+            finally:
+                self.pending.pop(message_id, None)
+    
+    def resolve(self, data: Dict) -> bool:
+        """Complete the request a response belongs to. Returns False if unknown."""
+        entry = self.pending.pop(str(data.get('message_id')), None)
+        if entry is None:
+            return False
+        command, future = entry
+        if future.done():
+            return True
+        if 'error_code' in data:
+            future.set_exception(MatterRequestError(command, data['error_code'], data.get('details')))
+        else:
+            future.set_result(data.get('result'))
+        return True
+    
+    def fail_all(self, exc: Exception):
+        """Fail every outstanding request, e.g. when the connection drops."""
+        for _, future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+
+class IngestPipeline:
+    """Bounded queues between the websocket reader and the message handlers.
+    
+    The reader only enqueues raw frames. A router task decodes them and
+    shards events by node_id onto per-worker queues, so each node's events
+    are handled in order while different nodes proceed independently.
+    
+    When a shard's backlog reaches the high watermark it switches to
+    conflation: a queued attribute update is overwritten in place by newer
+    values for the same attribute until the backlog drops to the low
+    watermark.
+    """
+    
+    def __init__(self, route: Callable[[str], Optional[Tuple[Any, Dict, Any]]],
+                 handle: Callable[[Dict], Awaitable[None]],
+                 workers: int = 4, queue_size: int = 1000,
+                 high_watermark: int = 500, low_watermark: int = 100):
+        self.route = route  # raw frame -> (shard key, event, conflation key) or None if handled
+        self.handle = handle
+        self.frames: asyncio.Queue = asyncio.Queue(queue_size)
+        workers = max(1, workers)
+        self.shards: List[asyncio.Queue] = [asyncio.Queue(queue_size) for _ in range(workers)]
+        # Per shard: conflation key -> queued item, and overload state
+        self.latest: List[Dict[Any, list]] = [{} for _ in range(workers)]
+        self.overloaded: List[bool] = [False] * workers
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.conflated = 0
+        self.overload_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # Frame received to handler done, i.e. websocket to outbound queue
+        self.latency = Histogram()
+    
+    def start(self):
+        """Start the router and worker tasks."""
+        self.tasks.append(asyncio.create_task(self._router()))
+        for shard, latest in zip(self.shards, self.latest):
+            self.tasks.append(asyncio.create_task(self._worker(shard, latest)))
+    
+    def stop(self):
+        """Cancel the router and worker tasks."""
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+    
+    async def put(self, frame: str):
+        """Enqueue a raw frame, waiting while the pipeline is full."""
+        await self.frames.put((time.monotonic(), frame))
+    
+    async def _router(self):
+        """Decode frames and distribute events to the node's shard."""
+        while True:
+            received, frame = await self.frames.get()
+            try:
+                routed = self.route(frame)
+            except Exception as e:
+                ingest_logger.error("Error decoding Matter message: %s", e)
+                continue
+            if routed is None:
+                continue
+            key, event, conflation_key = routed
+            shard = key % len(self.shards) if isinstance(key, int) else 0
+            queue = self.shards[shard]
+            latest = self.latest[shard]
+            
+            backlog = queue.qsize()
+            if self.overloaded[shard]:
+                if backlog <= self.low_watermark:
+                    self.overloaded[shard] = False
+                    ingest_logger.info("Ingest shard %s recovered, backlog %s", shard, backlog)
+            elif backlog >= self.high_watermark:
+                self.overloaded[shard] = True
+                self.overload_count += 1
+                ingest_logger.warning("Ingest shard %s overloaded, backlog %s, conflating updates", shard, backlog)
+            
+            if conflation_key is None:
+                # Other events must not be overtaken by later conflated values
+                latest.clear()
+            elif self.overloaded[shard]:
+                item = latest.get(conflation_key)
+                if item is not None:
+                    item[1] = event  # Keep queue position and arrival time, take newest value
+                    self.conflated += 1
+                    continue
+            elif latest:
+                latest.pop(conflation_key, None)
+            
+            item = [received, event, conflation_key]
+            if conflation_key is not None and self.overloaded[shard]:
+                latest[conflation_key] = item
+            await queue.put(item)
+    
+    async def _worker(self, queue: asyncio.Queue, latest: Dict[Any, list]):
+        """Handle events from one shard in order."""
+        while True:
+            item = await queue.get()
+            received, event, conflation_key = item
+            if conflation_key is not None and latest.get(conflation_key) is item:
+                del latest[conflation_key]
+            wait = time.monotonic() - received
+            self.wait_total += wait
+            if wait > self.wait_max:
+                self.wait_max = wait
+            self.processed += 1
+            await self.handle(event)
+            self.latency.observe(time.monotonic() - received)
+    
+    def stats(self) -> Dict:
+        """Queue depths and wait times; resets the maximum wait."""
+        stats = {
+            "frame_queue": self.frames.qsize(),
+            "shard_queues": [shard.qsize() for shard in self.shards],
+            "processed": self.processed,
+            "conflated": self.conflated,
+            "overloads": self.overload_count,
+            "wait_avg_ms": round(self.wait_total / self.processed * 1000, 2) if self.processed else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2)
+        }
+        self.wait_max = 0.0
+        return stats
+
+
+class OutboundQueue:
+    """Bridge-owned, bounded MQTT publish queue with priority classes.
+    
+    Messages wait here (not in paho) until the broker connection can take
+    them, so an outage costs bounded memory. Classes drain in priority
+    order; each has a message limit and a policy for when it is full:
+    
+    - keep_latest: one message per topic, a newer value replaces the queued
+      one in place; the oldest topic is dropped when full
+    - drop_oldest: FIFO, the oldest message is dropped when full
+    - block: FIFO, publishers wait for space; only for control, whose
+      publishers await put(). State and bulk are queued from synchronous
+      code with put_nowait() and cannot wait.
+    
+    When the total payload size exceeds max_bytes the oldest messages of the
+    lowest priority non-blocking class are dropped. on_drop is called with the
+    topic of every dropped message.
+    """
+    
+    PRIORITIES = ('control', 'state', 'bulk')  # Drain order
+    DEFAULTS = {
+        'control': {'max_messages': 1000, 'policy': 'drop_oldest'},
+        'state': {'max_messages': 5000, 'policy': 'keep_latest'},
+        'bulk': {'max_messages': 50000, 'policy': 'keep_latest'}
+    }
+    POLICIES = ('keep_latest', 'drop_oldest', 'block')
+    BLOCKING_CLASSES = ('control',)  # Classes fed through the awaitable put()
+    
+    def __init__(self, config: Dict):
+        self.max_bytes = int(config.get('max_bytes', 8 * 1024 * 1024))
+        self.policies: Dict[str, str] = {}
+        self.limits: Dict[str, int] = {}
+        for name in self.PRIORITIES:
+            class_config = dict(self.DEFAULTS[name], **(config.get(name) or {}))
+            policy = class_config['policy']
+            if policy not in self.POLICIES:
+                raise ValueError(f"Unknown outbound queue policy for {name}: {policy}")
+            if policy == 'block' and name not in self.BLOCKING_CLASSES:
+                raise ValueError(f"Outbound queue policy block is only supported for "
+                                 f"{', '.join(self.BLOCKING_CLASSES)}, not {name}")
+            self.policies[name] = policy
+            self.limits[name] = max(1, int(class_config['max_messages']))
+        # Class -> key (topic for keep_latest, sequence otherwise) -> (topic, payload, qos, retain, queued)
+        self.queues: Dict[str, OrderedDict] = {name: OrderedDict() for name in self.PRIORITIES}
+        self.sequence = itertools.count()
+        self.bytes = 0
+        self.drops = {name: 0 for name in self.PRIORITIES}
+        self.replaced = {name: 0 for name in self.PRIORITIES}
+        self.ready = asyncio.Event()  # Set while anything is queued
+        self.space = asyncio.Event()  # Set when a message leaves the queue
+        self.on_drop: Optional[Callable[[str], None]] = None
+        self.wait = Histogram()  # Queued to handed to paho
+    
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+    
+    @staticmethod
+    def _size(payload: Any) -> int:
+        return len(payload) if payload is not None else 0
+    
+    def _drop_oldest(self, name: str):
+        _, message = self.queues[name].popitem(last=False)
+        self.bytes -= self._size(message[1])
+        self.drops[name] += 1
+        if self.on_drop is not None:
+            self.on_drop(message[0])
+    
+    def put_nowait(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False,
+                   priority: str = 'state'):
+        """Queue a message without waiting; full classes drop their oldest message."""
+        queue = self.queues[priority]
+        size = self._size(payload)
+        if self.policies[priority] == 'keep_latest':
+            previous = queue.get(topic)
+            if previous is not None:
+                self.bytes += size - self._size(previous[1])
+                queue[topic] = (topic, payload, qos, retain, time.monotonic())
+                self.replaced[priority] += 1
+                return
+            # An older value queued in another class must not overwrite this one
+            for name in self.PRIORITIES:
+                if name != priority and self.policies[name] == 'keep_latest':
+                    previous = self.queues[name].pop(topic, None)
+                    if previous is not None:
+                        self.bytes -= self._size(previous[1])
+                        self.replaced[name] += 1
+            key = topic
+        else:
+            key = next(self.sequence)
+        
+        if len(queue) >= self.limits[priority]:
+            self._drop_oldest(priority)
+        queue[key] = (topic, payload, qos, retain, time.monotonic())
+        self.bytes += size
+        
+        # Memory cap: shed the lowest priority messages first
+        if self.bytes > self.max_bytes:
+            for name in reversed(self.PRIORITIES):
+                if self.policies[name] == 'block':
+                    continue
+                while self.queues[name] and self.bytes > self.max_bytes:
+                    self._drop_oldest(name)
+        self.ready.set()
+    
+    async def put(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False,
+                  priority: str = 'state'):
+        """Queue a message, waiting for space if the class blocks."""
+        if self.policies[priority] == 'block':
+            while len(self.queues[priority]) >= self.limits[priority]:
+                self.space.clear()
+                await self.space.wait()
+        self.put_nowait(topic, payload, qos, retain, priority)
+    
+    def pop(self) -> Optional[Tuple[str, Any, int, bool]]:
+        """Take the oldest message of the highest priority class, None if empty."""
+        for name in self.PRIORITIES:
+            queue = self.queues[name]
+            if queue:
+                _, message = queue.popitem(last=False)
+                self.bytes -= self._size(message[1])
+                self.space.set()
+                self.wait.observe(time.monotonic() - message[4])
+                return message[:4]
+        self.ready.clear()
+        return None
+    
+    def stats(self) -> Dict:
+        """Queue sizes, bytes, drops and replaced messages per class."""
+        return {
+            "messages": {name: len(queue) for name, queue in self.queues.items()},
+            "bytes": self.bytes,
+            "dropped": dict(self.drops),
+            "replaced": dict(self.replaced),
+            "wait": self.wait.summary()
+        }
+
+
+class SnapshotBacklog:
+    """Snapshot attributes without a converter, published in the background.
+    
+    Generic fallback and descriptor attributes make up most of a node
+    snapshot but are rarely what consumers wait for. They are held here in
+    arrival order, keyed by (node_id, path), and handed out at a fixed rate
+    once the outbound bulk class has room. A live report for a pending
+    attribute removes it, so an older snapshot value never follows it.
+    """
+    
+    TICK = 0.1  # Seconds between batches
+    
+    def __init__(self, publish: Callable[[int, str, Any], bool], outbound: OutboundQueue, rate: float):
+        self.publish = publish
+        self.outbound = outbound
+        self.rate = rate  # Attributes per second, 0 = as fast as the outbound queue takes them
+        self.pending: OrderedDict = OrderedDict()  # (node_id, path) -> value
+        self.published = 0
+        self.superseded = 0  # Dropped because a live report arrived first
+        self.ready = asyncio.Event()
+    
+    def __len__(self) -> int:
+        return len(self.pending)
+    
+    def add(self, node_id: int, path: str, value: Any):
+        """Queue an attribute; a newer snapshot value replaces the pending one in place."""
+        self.pending[(node_id, path)] = value
+        self.ready.set()
+    
+    def discard(self, node_id: int, path: str):
+        """Drop a pending attribute after a live report for it."""
+        if self.pending.pop((node_id, path), None) is not None:
+            self.superseded += 1
+    
+    def forget(self, node_id: int):
+        """Drop everything pending for a removed node."""
+        for key in [key for key in self.pending if key[0] == node_id]:
+            del self.pending[key]
+    
+    async def run(self):
+        """Publish pending attributes, at most rate per second."""
+        batch = max(1, int(self.rate * self.TICK)) if self.rate else 0
+        bulk = self.outbound.queues['bulk']
+        limit = max(1, self.outbound.limits['bulk'] // 2)
+        while True:
+            if not self.pending:
+                self.ready.clear()
+                await self.ready.wait()
+            # Only top up the bulk class, live state must never queue behind a full one
+            room = max(0, limit - len(bulk))
+            count = min(batch or room, room, len(self.pending))
+            for _ in range(count):
+                (node_id, path), value = self.pending.popitem(last=False)
+                try:
+                    if self.publish(node_id, path, value):
+                        self.published += 1
+                except Exception as e:
+                    devices_logger.debug("Skipping attribute %s of node %s: %s", path, node_id, e)
+            await asyncio.sleep(self.TICK if batch or count <= 0 else 0)
+    
+    def stats(self) -> Dict:
+        """Pending, published and superseded attribute counts."""
+        return {
+            "pending": len(self.pending),
+            "published": self.published,
+            "superseded": self.superseded
+        }
 
 
-class DeviceRegistry:
-    """Registry for mapping between node IDs and friendly names."""
+class AsyncioMQTTAdapter:
+    """Drives paho's network loop from the asyncio event loop (no background thread)."""
     
-    def __init__(self, config: Dict):
-        self.config = config
-        self.devices: Dict[int, Dict] = {}  # node_id -> device info
+    RECONNECT_DELAY = 5  # seconds between reconnect attempts
+    
+    def __init__(self, client: mqtt.Client, loop: asyncio.AbstractEventLoop):
+        self.client = client
+        self.loop = loop
+        self.running = True
+        self.misc_task: Optional[asyncio.Task] = None
+        self.drained = asyncio.Event()  # Set while paho has nothing left to write
+        self.drained.set()
+        self.loop_thread = threading.get_ident()
         
-    def register_device(self, node_id: int, info: Dict = None):
-        """Register a device with its node ID."""
-        device_info = {
-            'node_id': node_id,
-            'friendly_name': self._get_friendly_name(node_id),
-            'last_seen': datetime.now(timezone.utc),
-            'available': True,
-            'info': info or {}
-        }
+        client.on_socket_open = self._on_loop(self.on_socket_open)
+        client.on_socket_close = self._on_loop(self.on_socket_close)
+        client.on_socket_register_write = self._on_loop(self.on_socket_register_write)
+        client.on_socket_unregister_write = self._on_loop(self.on_socket_unregister_write)
+    
+    def _on_loop(self, callback: Callable) -> Callable:
+        """Wrap a socket callback so it runs on the event loop.
         
-        self.devices[node_id] = device_info
-        logger.info(f"Registered device: node {node_id} as '{device_info['friendly_name']}'")
+        paho calls these from the reconnect worker thread too. The file
+        descriptor is taken there, as the socket may be closed by the time
+        the loop runs the callback.
+        """
+        def dispatch(client, userdata, sock):
+            if threading.get_ident() == self.loop_thread:
+                callback(client, userdata, sock)
+            else:
+                self.loop.call_soon_threadsafe(callback, client, userdata, sock.fileno())
+        return dispatch
+    
+    def on_socket_open(self, client, userdata, sock):
+        """Watch the new broker socket for incoming data."""
+        self.loop.add_reader(sock, client.loop_read)
+        if self.misc_task is None or self.misc_task.done():
+            self.misc_task = self.loop.create_task(self.misc_loop())
+    
+    def on_socket_close(self, client, userdata, sock):
+        """Stop watching a closed broker socket."""
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self.drained.set()
+    
+    def on_socket_register_write(self, client, userdata, sock):
+        """Flush queued packets once the socket is writable.
         
-    def _get_friendly_name(self, node_id: int) -> str:
-        """Get friendly name from config or use node_id."""
-        device_config = self.config.get('devices', {}).get(node_id, {})
-        return device_config.get('friendly_name', f"node_{node_id}")
+        Everything published during one loop iteration is written by a
+        single loop_write() call.
+        """
+        self.drained.clear()
+        self.loop.add_writer(sock, client.loop_write)
     
-    def get_device_by_node_id(self, node_id: int) -> Optional[Dict]:
-        """Get device info by node ID."""
-        return self.devices.get(node_id)
+    def on_socket_unregister_write(self, client, userdata, sock):
+        """Outgoing queue drained."""
+        self.loop.remove_writer(sock)
+        self.drained.set()
     
-    def get_topic_identifier(self, node_id: int) -> str:
-        """Get topic identifier (friendly name or node_id)."""
-        device = self.get_device_by_node_id(node_id)
-        if not device:
-            # Not yet registered, check config
-            device_config = self.config.get('devices', {}).get(node_id, {})
-            return device_config.get('friendly_name', f"node_{node_id}")
+    async def misc_loop(self):
+        """Keepalive pings, retries and reconnects.
         
-        return device['friendly_name']
+        Reconnecting resolves the broker name and opens a blocking socket, so
+        it runs in a worker thread instead of stalling the event loop.
+        """
+        while self.running:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    mqtt_logger.info("Reconnecting to MQTT broker at %s:%s", MQTT_BROKER, MQTT_PORT)
+                    await asyncio.to_thread(self.client.reconnect)
+                except OSError as e:
+                    mqtt_logger.warning("MQTT reconnect failed: %s", e)
+                    await asyncio.sleep(self.RECONNECT_DELAY)
+                    continue
+            await asyncio.sleep(1)
     
-    def update_availability(self, node_id: int, available: bool):
-        """Update device availability."""
-        if node_id in self.devices:
-            self.devices[node_id]['available'] = available
-            self.devices[node_id]['last_seen'] = datetime.now(timezone.utc)
+    async def wait_drained(self):
+        """Wait until paho has written everything handed to it."""
+        await self.drained.wait()
+    
+    def stop(self):
+        """Stop reconnecting."""
+        self.running = False
+        if self.misc_task:
+            self.misc_task.cancel()
 
 
 class MatterMQTTBridge:
     """Bridge between Matter devices and MQTT with IEEE address support."""
     
+    OUTBOUND_BATCH = 20  # Messages handed to paho per write
+    
     def __init__(self):
         self.mqtt_client: Optional[mqtt.Client] = None
+        self.mqtt_adapter: Optional[AsyncioMQTTAdapter] = None
         self.ws_client: Optional[websockets.WebSocketClientProtocol] = None
         self.running = False
-        self.message_id = 0
+        self.command_tasks = set()  # Keep references to in-flight command tasks
         self.config = self.load_config()
+        bridge_config = self.config.get('bridge', {})
+        configure_logging(bridge_config)
         self.device_registry = DeviceRegistry(self.config)
+        self.requests = MatterRequestTracker(
+            timeout=float(bridge_config.get('request_timeout', 30)),
+            max_in_flight=int(bridge_config.get('max_inflight_requests', 8))
+        )
+        self.command_retries = int(bridge_config.get('command_retries', 1))
+        # Group name -> member identifiers (friendly name, node ID or IEEE address)
+        # Ints are kept as parsed: YAML reads an unquoted 0x... IEEE address as one
+        self.groups: Dict[str, List[Any]] = {
+            str(name): [member if isinstance(member, int) else str(member)
+                        for member in ((group or {}).get('devices') or [])]
+            for name, group in (self.config.get('groups') or {}).items()
+        }
+        # Nodes a group or wildcard command is sent to at the same time
+        self.fanout_concurrency = max(1, int(bridge_config.get('command_concurrency', 8)))
+        self.info_interval = float(bridge_config.get('info_interval', 60))
+        sync_config = bridge_config.get('initial_sync') or {}
+        self.sync_mode = sync_config.get('mode', 'snapshot')  # snapshot or per_node
+        self.sync_concurrency = int(sync_config.get('concurrency', 4))
+        # Unmapped snapshot attributes per second, published in the background
+        self.background_rate = float(sync_config.get('background_rate', 500))
+        # Largest accepted websocket frame in bytes, 0 = unlimited
+        max_size = int(bridge_config.get('websocket_max_size', 64 * 1024 * 1024))
+        self.websocket_max_size = max_size or None
+        self.sync_generation = 0  # Incremented on every Matter server connection
+        # Live values reported while a snapshot is applied: (node_id, path) -> value
+        self.live_updates: Optional[Dict[Tuple[int, str], Any]] = None
+        self.metrics = BridgeMetrics()
+        metrics_config = bridge_config.get('metrics') or {}
+        self.metrics_host = metrics_config.get('host', '0.0.0.0')
+        self.metrics_port = int(metrics_config.get('port', 0))  # 0 = no HTTP endpoint
+        self.loop_monitor = LoopLagMonitor(
+            self.metrics,
+            interval=float(metrics_config.get('loop_lag_interval', 0.5)),
+            threshold=float(metrics_config.get('loop_stall_ms', 250)) / 1000
+        )
+        profiling_config = bridge_config.get('profiling') or {}
+        self.profiler = HotPathProfiler(
+            directory=profiling_config.get('directory', '/app/data'),
+            max_seconds=float(profiling_config.get('max_seconds', 300))
+        )
+        # Handlers slower than this are logged with event type and node (0 = off)
+        self.slow_handler_threshold = float(profiling_config.get('slow_handler_ms', 100)) / 1000
+        ingest_config = bridge_config.get('ingest') or {}
+        self.ingest = IngestPipeline(
+            self.route_matter_message,
+            self.handle_matter_event,
+            workers=int(ingest_config.get('workers', 4)),
+            queue_size=int(ingest_config.get('queue_size', 1000)),
+            high_watermark=int(ingest_config.get('high_watermark', 500)),
+            low_watermark=int(ingest_config.get('low_watermark', 100))
+        )
+        self.change_filter = ChangeFilter(bridge_config.get('change_only') or {})
+        self.attribute_filter = AttributeFilter(bridge_config.get('attribute_filter') or {},
+                                                self.config.get('devices') or {})
+        self.outbound = OutboundQueue(bridge_config.get('outbound_queue') or {})
+        self.outbound.on_drop = self._outbound_dropped
+        self.mqtt_connected = asyncio.Event()
+        self.snapshot_backlog = SnapshotBacklog(self._publish_snapshot_attribute, self.outbound,
+                                                self.background_rate)
+        self.watchdog = AvailabilityWatchdog(
+            self._availability_expired,
+            default_timeout=float(bridge_config.get('availability_timeout', 300) or 0)
+        )
+        # Device class (battery, mains) -> timeout
+        self.availability_timeouts = {
+            str(device_class): float(timeout or 0)
+            for device_class, timeout in (bridge_config.get('availability_timeouts') or {}).items()
+        }
+        
+        # Warm start state
+        state_file = bridge_config.get('state_file')
+        self.checkpoint_interval = float(bridge_config.get('checkpoint_interval', 300))
+        self.state_store: Optional[StateStore] = None
+        self.published_values: Dict[str, Any] = {}  # topic -> last published value
+        self.unsaved_topics: set = set()
+        if state_file:
+            try:
+                self.state_store = StateStore(state_file)
+                self.load_state()
+            except (sqlite3.Error, OSError, ValueError) as e:
+                logger.error("Error loading state from %s: %s", state_file, e)
+        
+        # Raw Matter server traffic capture for benchmarks/replay.py
+        capture_file = bridge_config.get('capture_file')
+        self.capture: Optional[FrameCapture] = None
+        if capture_file:
+            try:
+                self.capture = FrameCapture(capture_file)
+                logger.info("Capturing Matter server frames to %s", capture_file)
+            except OSError as e:
+                logger.error("Error opening capture file %s: %s", capture_file, e)
         
     def load_config(self) -> Dict:
         """Load configuration from YAML file."""
         try:
             with open(CONFIG_FILE, 'r') as f:
                 config = yaml.safe_load(f)
-                logger.info(f"Loaded configuration from {CONFIG_FILE}")
+                logger.info("Loaded configuration from %s", CONFIG_FILE)
                 return config or {}
         except FileNotFoundError:
-            logger.warning(f"Config file {CONFIG_FILE} not found, using defaults")
+            logger.warning("Config file %s not found, using defaults", CONFIG_FILE)
             return {}
         except Exception as e:
-            logger.error(f"Error loading config: {e}")
+            logger.error("Error loading config: %s", e)
             return {}
     
     def setup_mqtt(self):
-        """Set up MQTT client."""
+        """Set up MQTT client on the running event loop."""
         self.mqtt_client = mqtt.Client(client_id="matter-mqtt-bridge")
+        self.mqtt_adapter = AsyncioMQTTAdapter(self.mqtt_client, asyncio.get_running_loop())
         
         if MQTT_USERNAME and MQTT_PASSWORD:
             self.mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
@@ -136,17 +1917,20 @@ class MatterMQTTBridge:
         )
         
         try:
-            logger.info(f"Connecting to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
+            mqtt_logger.info("Connecting to MQTT broker at %s:%s", MQTT_BROKER, MQTT_PORT)
             self.mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            self.mqtt_client.loop_start()
         except Exception as e:
-            logger.error(f"Failed to connect to MQTT broker: {e}")
+            mqtt_logger.error("Failed to connect to MQTT broker: %s", e)
             raise
     
     def on_mqtt_connect(self, client, userdata, flags, rc):
         """Handle MQTT connection."""
         if rc == 0:
-            logger.info("Connected to MQTT broker")
+            mqtt_logger.info("Connected to MQTT broker")
+            self.metrics.connections["mqtt"] += 1
+            self.mqtt_connected.set()
+            # A broker without persistence lost the retained bridge/info documents
+            self.device_registry.info_dirty = True
             # Publish online status (like zigbee2mqtt)
             self.mqtt_client.publish(
                 f"{MQTT_BASE_TOPIC}/bridge/state",
@@ -156,21 +1940,26 @@ class MatterMQTTBridge:
             )
             # Subscribe to command topics (both friendly name and IEEE)
             self.mqtt_client.subscribe(f"{MQTT_BASE_TOPIC}/+/set/#")
-            logger.info(f"Subscribed to {MQTT_BASE_TOPIC}/+/set/#")
+            mqtt_logger.info("Subscribed to %s/+/set/#", MQTT_BASE_TOPIC)
         else:
-            logger.error(f"Failed to connect to MQTT broker, return code {rc}")
+            mqtt_logger.error("Failed to connect to MQTT broker, return code %s", rc)
     
     def on_mqtt_disconnect(self, client, userdata, rc):
         """Handle MQTT disconnection."""
+        self.mqtt_connected.clear()
         if rc != 0:
-            logger.warning(f"Unexpected MQTT disconnection, return code {rc}")
+            mqtt_logger.warning("Unexpected MQTT disconnection, return code %s", rc)
     
     def on_mqtt_message(self, client, userdata, msg):
-        """Handle incoming MQTT messages (commands)."""
+        """Handle incoming MQTT messages (commands).
+        
+        Runs on the event loop thread (see AsyncioMQTTAdapter), so tasks can
+        be scheduled directly.
+        """
         try:
             topic = msg.topic
             payload = msg.payload.decode('utf-8')
-            logger.info(f"MQTT message received: {topic} = {payload}")
+            mqtt_logger.debug("MQTT message received: %s = %s", topic, payload)
             
             # Parse topic: matter/<device_identifier>/set/<cluster>/<command>
             parts = topic.split('/')
@@ -179,16 +1968,38 @@ class MatterMQTTBridge:
                 cluster = parts[3]
                 command = parts[4] if len(parts) > 4 else 'default'
                 
-                # Resolve to node_id
+                if device_identifier == 'bridge':
+                    self._handle_bridge_command(cluster, payload)
+                    return
+                
+                # Resolve to node_id, then to a group or name pattern
                 node_id = self._resolve_device_identifier(device_identifier)
-                if node_id:
-                    asyncio.create_task(
-                        self.send_matter_command(node_id, cluster, command, payload)
-                    )
+                if node_id is not None:
+                    coroutine = self.send_matter_command(node_id, cluster, command, payload)
                 else:
-                    logger.warning(f"Unknown device: {device_identifier}")
+                    targets = self._resolve_command_targets(device_identifier)
+                    if targets is None:
+                        mqtt_logger.warning("Unknown device: %s", device_identifier)
+                        return
+                    node_ids, unknown = targets
+                    coroutine = self.send_group_command(device_identifier, node_ids, cluster, command, payload,
+                                                        unknown)
+                task = asyncio.create_task(coroutine)
+                self.command_tasks.add(task)
+                task.add_done_callback(self.command_tasks.discard)
         except Exception as e:
-            logger.error(f"Error processing MQTT message: {e}")
+            mqtt_logger.error("Error processing MQTT message: %s", e)
+    
+    def _handle_bridge_command(self, command: str, payload: str):
+        """Handle matter/bridge/set/<command>."""
+        if command == 'profile':
+            # Payload: window length in seconds, "stop" ends a running window
+            if payload.strip().lower() == 'stop':
+                self.profiler.stop()
+            elif self.profiler.start(float(payload or 60)) is None:
+                mqtt_logger.warning("Profiling already running")
+        else:
+            mqtt_logger.warning("Unknown bridge command: %s", command)
     
     def _resolve_device_identifier(self, identifier: str) -> Optional[int]:
         """Resolve device identifier (IEEE or friendly name) to node_id."""
@@ -200,150 +2011,471 @@ class MatterMQTTBridge:
         except ValueError:
             pass
         
-        # Try IEEE address
-        device = self.device_registry.get_device_by_ieee(identifier)
+        # Try friendly name
+        device = self.device_registry.get_device_by_friendly_name(identifier)
         if device:
             return device['node_id']
         
-        # Try friendly name
-        for node_id, dev_info in self.device_registry.devices.items():
-            if dev_info['friendly_name'] == identifier:
-                return node_id
+        # Try IEEE address
+        if identifier.lower().startswith('0x'):
+            device = self.device_registry.get_device_by_ieee(identifier)
+            if device:
+                return device['node_id']
         
         return None
     
-    async def send_matter_command(self, node_id: int, cluster: str, command: str, payload: str):
-        """Send command to Matter device via websocket."""
+    def _build_command(self, node_id: int, cluster: str, command: str, payload: str) -> Optional[Dict]:
+        """Resolve an MQTT command to device.send_command arguments.
+        
+        The endpoint is the lowest one serving the cluster unless the cluster
+        name carries one (onoff_2). Returns None, after logging why, for
+        commands the node cannot take, so they never reach the Matter server.
+        """
+        endpoint_id = None
+        base, _, suffix = cluster.rpartition('_')
+        if base and suffix.isdigit():
+            cluster, endpoint_id = base, int(suffix)
+        
+        spec = COMMAND_CLUSTERS.get(cluster)
+        if spec is None:
+            matter_logger.warning("Unsupported command cluster %s for node %s", cluster, node_id)
+            return None
+        cluster_id, commands = spec
+        command_id = commands.get(command)
+        if command_id is None:
+            command_id = commands.get(payload.strip().lower())
+        if command_id is None:
+            matter_logger.warning("Unsupported command %s/%s (payload %r) for node %s", cluster, command, payload, node_id)
+            return None
+        
+        capabilities = self.device_registry.capabilities
+        endpoints = capabilities.endpoints(node_id, cluster_id)
+        if endpoint_id is None:
+            if endpoints is None:
+                endpoint_id = 1  # Capabilities unknown, default endpoint
+            elif endpoints:
+                endpoint_id = endpoints[0]
+            else:
+                matter_logger.warning("Node %s has no %s cluster", node_id, cluster)
+                return None
+        elif endpoints is not None and endpoint_id not in endpoints:
+            matter_logger.warning("Node %s has no %s cluster on endpoint %s", node_id, cluster, endpoint_id)
+            return None
+        if capabilities.accepts(node_id, endpoint_id, cluster_id, command_id) is False:
+            matter_logger.warning("Node %s endpoint %s does not accept %s/%s", node_id, endpoint_id, cluster, command)
+            return None
+        
+        return {
+            "node_id": node_id,
+            "endpoint_id": endpoint_id,
+            "cluster_id": cluster_id,
+            "command_id": command_id
+        }
+    
+    async def send_matter_command(self, node_id: int, cluster: str, command: str, payload: str) -> Tuple[str, float]:
+        """Send command to Matter device via websocket.
+        
+        Returns the outcome (ok, rejected, timeout, error, disconnected) and
+        the round trip in milliseconds.
+        """
+        started = time.monotonic()
         try:
             if not self.ws_client:
-                logger.error("WebSocket not connected")
-                return
-            
-            self.message_id += 1
+                matter_logger.error("WebSocket not connected")
+                return ("disconnected", 0.0)
             
-            # Build Matter command based on cluster
-            matter_cmd = {
-                "message_id": str(self.message_id),
-                "command": "device.send_command",
-                "args": {
-                    "node_id": node_id,
-                    "endpoint_id": 1,  # Default endpoint
-                }
-            }
+            # Map the MQTT command to a cluster, command and endpoint
+            args = self._build_command(node_id, cluster, command, payload)
+            if args is None:
+                return ("rejected", 0.0)
             
-            # Map MQTT commands to Matter clusters
-            if cluster == "onoff":
-                matter_cmd["args"]["cluster_id"] = 0x0006
-                if command == "on" or payload.lower() == "on":
-                    matter_cmd["args"]["command_id"] = 0x01  # On
-                elif command == "off" or payload.lower() == "off":
-                    matter_cmd["args"]["command_id"] = 0x00  # Off
-                elif command == "toggle":
-                    matter_cmd["args"]["command_id"] = 0x02  # Toggle
+            # Toggle is not idempotent, never resend it
+            if (args["cluster_id"], args["command_id"]) in NON_IDEMPOTENT_COMMANDS:
+                retries = 0
+            else:
+                retries = self.command_retries
             
-            # Send to Matter server
-            await self.ws_client.send(json.dumps(matter_cmd))
-            logger.info(f"Sent command to Matter device {node_id}: {cluster}/{command}")
+            # Send to Matter server and wait for the result
+            started = time.monotonic()
+            result = await self.matter_request("device.send_command", args, retries=retries)
+            elapsed = time.monotonic() - started
+            self.metrics.command_rtt.observe(elapsed)
+            elapsed_ms = elapsed * 1000
+            matter_logger.info("Sent command to Matter device %s: %s/%s (%.0f ms)", node_id, cluster, command, elapsed_ms)
+            matter_logger.debug("Command result: %s", result)
+            return ("ok", elapsed_ms)
             
+        except asyncio.TimeoutError:
+            matter_logger.error("Matter command %s/%s to node %s timed out", cluster, command, node_id)
+            return ("timeout", (time.monotonic() - started) * 1000)
         except Exception as e:
-            logger.error(f"Error sending Matter command: {e}")
+            matter_logger.error("Error sending Matter command: %s", e)
+            return ("error", (time.monotonic() - started) * 1000)
+    
+    def _resolve_group_member(self, member: Any) -> Tuple[Optional[int], str]:
+        """Resolve a group member to (node_id or None, name to report it by)."""
+        if isinstance(member, int):
+            # A node ID, or an IEEE address YAML parsed as an int
+            node_id = self._resolve_device_identifier(str(member))
+            if node_id is None:
+                node_id = self._resolve_device_identifier(normalize_ieee(member))
+            return (node_id, normalize_ieee(member) if node_id is None else str(member))
+        return (self._resolve_device_identifier(member), member)
+    
+    def _resolve_command_targets(self, identifier: str) -> Optional[Tuple[List[int], List[str]]]:
+        """Resolve a group name or friendly name pattern (bedroom_*) to node IDs.
+        
+        Returns (node_ids, unknown) where unknown lists group members that match no device.
+        """
+        members = self.groups.get(identifier)
+        if members is not None:
+            node_ids = []
+            unknown = []
+            for member in members:
+                node_id, name = self._resolve_group_member(member)
+                if node_id is None:
+                    mqtt_logger.warning("Unknown device %s in group %s", name, identifier)
+                    unknown.append(name)
+                elif node_id not in node_ids:
+                    node_ids.append(node_id)
+            return (node_ids, unknown)
+        if any(char in identifier for char in '*?['):
+            return ([node_id for node_id, device in self.device_registry.devices.items()
+                     if fnmatch.fnmatchcase(device['friendly_name'], identifier)], [])
+        return None
+    
+    async def send_group_command(self, target: str, node_ids: List[int], cluster: str, command: str, payload: str,
+                                 unknown: Optional[List[str]] = None):
+        """Send one command to many nodes concurrently and publish one aggregated result.
+        
+        Group members in unknown match no device; they are reported with status "unknown".
+        """
+        unknown = unknown or []
+        semaphore = asyncio.Semaphore(self.fanout_concurrency)
+        started = time.monotonic()
+        
+        async def send(node_id: int) -> Tuple[int, str, float]:
+            async with semaphore:
+                status, latency_ms = await self.send_matter_command(node_id, cluster, command, payload)
+                return (node_id, status, latency_ms)
+        
+        results = await asyncio.gather(*(send(node_id) for node_id in node_ids))
+        elapsed_ms = (time.monotonic() - started) * 1000
+        succeeded = sum(1 for _, status, _ in results if status == "ok")
+        total = len(results) + len(unknown)
+        matter_logger.info("Command %s/%s to %s: %s of %s nodes ok (%.0f ms)",
+                           cluster, command, target, succeeded, total, elapsed_ms)
+        await self.publish(
+            f"{MQTT_BASE_TOPIC}/bridge/response/command",
+            payload=codec.dumps({
+                "target": target,
+                "cluster": cluster,
+                "command": command,
+                "payload": payload,
+                "ok": succeeded,
+                "failed": total - succeeded,
+                "elapsed_ms": round(elapsed_ms, 1),
+                "nodes": [
+                    {
+                        "node_id": node_id,
+                        "friendly_name": self.device_registry.get_topic_identifier(node_id),
+                        "status": status,
+                        "latency_ms": round(latency_ms, 1)
+                    }
+                    for node_id, status, latency_ms in results
+                ] + [
+                    {"node_id": None, "friendly_name": name, "status": "unknown", "latency_ms": 0.0}
+                    for name in unknown
+                ],
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }),
+            qos=1,
+            priority='control'
+        )
     
     async def connect_matter_server(self):
         """Connect to Matter server WebSocket."""
         while self.running:
             try:
-                logger.info(f"Connecting to Matter server at {MATTER_SERVER_URL}")
-                async with websockets.connect(MATTER_SERVER_URL) as websocket:
+                matter_logger.info("Connecting to Matter server at %s", MATTER_SERVER_URL)
+                async with websockets.connect(MATTER_SERVER_URL,
+                                              max_size=self.websocket_max_size) as websocket:
                     self.ws_client = websocket
-                    logger.info("Connected to Matter server")
-                    
-                    # Get all devices and their IEEE addresses
-                    await self.discover_devices()
+                    self.sync_generation += 1
+                    self.metrics.connections["matter"] += 1
+                    matter_logger.info("Connected to Matter server")
                     
-                    # Subscribe to all device events
-                    await self.subscribe_to_events()
-                    
-                    # Listen for messages
-                    async for message in websocket:
-                        await self.handle_matter_message(message)
+                    # Listen for messages (responses are needed by the requests below)
+                    reader = asyncio.create_task(self.read_matter_messages(websocket))
+                    try:
+                        # Get known devices first, one at a time
+                        if self.sync_mode == 'per_node':
+                            await self.sync_known_nodes()
+                        
+                        # Subscribe to all device events, the reply is the node snapshot
+                        await self.subscribe_to_events()
+                        
+                        await reader
+                    finally:
+                        reader.cancel()
+                        self.ws_client = None
                         
             except websockets.exceptions.ConnectionClosed:
-                logger.warning("Matter server connection closed, reconnecting...")
+                matter_logger.warning("Matter server connection closed, reconnecting...")
                 await asyncio.sleep(5)
             except Exception as e:
-                logger.error(f"Error connecting to Matter server: {e}")
+                matter_logger.error("Error connecting to Matter server: %s", e)
                 await asyncio.sleep(5)
     
-    async def discover_devices(self):
-        """Request list of Matter devices from server."""
+    async def read_matter_messages(self, websocket):
+        """Dispatch every frame received from the Matter server."""
         try:
-            # Just send the request - response will be handled in handle_matter_message
-            self.message_id += 1
-            get_nodes_msg = {
-                "message_id": str(self.message_id),
-                "command": "get_nodes"
-            }
-            await self.ws_client.send(json.dumps(get_nodes_msg))
-            logger.info("Requested existing nodes")
-                        
-        except Exception as e:
-            logger.error(f"Error requesting devices: {e}")
+            async for message in websocket:
+                if self.capture is not None:
+                    self.capture.write(message)
+                await self.ingest.put(message)
+        finally:
+            # Nothing can answer outstanding requests any more
+            self.requests.fail_all(ConnectionError("Matter server connection closed"))
+    
+    async def matter_request(self, command: str, args: Optional[Dict] = None,
+                             timeout: Optional[float] = None, retries: int = 0) -> Any:
+        """Send a request to the Matter server and wait for its result."""
+        for attempt in range(retries + 1):
+            try:
+                return await self.requests.request(self.ws_client, command, args, timeout)
+            except asyncio.TimeoutError:
+                if attempt == retries:
+                    raise
+                matter_logger.warning("Matter request %s timed out, retrying (%s/%s)", command, attempt + 1, retries)
+    
+    async def discover_devices(self) -> Any:
+        """Request list of Matter devices from server."""
+        matter_logger.info("Requesting existing nodes")
+        return await self.matter_request("get_nodes")
+    
+    async def sync_known_nodes(self):
+        """Fetch known nodes one by one with get_node, publishing each as it arrives.
+        
+        Node IDs come from the device config and the registry; the snapshot
+        returned by start_listening picks up anything not known yet.
+        """
+        node_ids = set(self.device_registry.devices)
+        node_ids.update(node_id for node_id in self.config.get('devices', {}) if isinstance(node_id, int))
+        if not node_ids:
+            return
+        
+        matter_logger.info("Syncing %s known nodes individually", len(node_ids))
+        semaphore = asyncio.Semaphore(self.sync_concurrency)
+        
+        async def sync_node(node_id: int):
+            async with semaphore:
+                try:
+                    node_data = await self.matter_request("get_node", {"node_id": node_id})
+                except asyncio.TimeoutError:
+                    # One slow node must not tear down the connection for the rest
+                    self.metrics.node_sync_failures += 1
+                    matter_logger.warning("Timed out fetching node %s", node_id)
+                    return
+                except (MatterRequestError, ConnectionError) as e:
+                    self.metrics.node_sync_failures += 1
+                    matter_logger.warning("Could not fetch node %s: %s", node_id, e)
+                    return
+                await self.register_node(node_data)
+        
+        await asyncio.gather(*(sync_node(node_id) for node_id in sorted(node_ids)))
     
     async def subscribe_to_events(self):
-        """Subscribe to Matter device events."""
+        """Subscribe to Matter device events and apply the node snapshot."""
         try:
-            # First, get existing nodes
-            await self.discover_devices()
-            
-            # Then subscribe to events
-            self.message_id += 1
-            subscribe_msg = {
-                "message_id": str(self.message_id),
-                "command": "start_listening"
-            }
-            await self.ws_client.send(json.dumps(subscribe_msg))
-            logger.info("Subscribed to Matter events")
+            # Events may be handled before the snapshot is applied
+            self.live_updates = {}
+            # The server answers start_listening with the full node list
+            nodes = await self.matter_request("start_listening")
+            matter_logger.info("Subscribed to Matter events")
+            if not isinstance(nodes, list):
+                nodes = await self.discover_devices()
+            await self.register_nodes(nodes)
+            await self.expire_missing_nodes()
         except Exception as e:
-            logger.error(f"Error subscribing to events: {e}")
+            # Drop the connection so the snapshot is retried after reconnecting
+            matter_logger.error("Error subscribing to events: %s", e)
+            raise
+        finally:
+            self.live_updates = None
+    
+    async def register_nodes(self, nodes: Any):
+        """Register nodes from a node list and publish their attributes."""
+        if not isinstance(nodes, list):
+            return
+        devices_logger.info("Received %s existing nodes", len(nodes))
+        for node_data in nodes:
+            started = time.perf_counter()
+            await self.register_node(node_data)
+            elapsed = time.perf_counter() - started
+            if self.slow_handler_threshold and elapsed > self.slow_handler_threshold:
+                self._log_slow_handler("node_snapshot", node_data, elapsed)
+            # Let live events through between nodes
+            await asyncio.sleep(0)
+    
+    async def register_node(self, node_data: Any):
+        """Register one node and publish what changed.
+        
+        Attributes are diffed against the bridge's last known state, so a
+        resync after reconnecting only publishes changed or new attributes,
+        and availability is only published when it flips.
+        """
+        if not isinstance(node_data, dict) or 'node_id' not in node_data:
+            return
+        node_id = node_data.get('node_id')
+        attributes = node_data.get('attributes') or {}
+        available = node_data.get('available', True) is not False
+        
+        device = self.device_registry.get_device_by_node_id(node_id)
+        was_available = device['available'] if device else None
+        
+        # Live events received since the snapshot are newer, keep them
+        live = self.live_updates
+        if live:
+            for path in attributes:
+                if (node_id, path) in live:
+                    attributes[path] = live[(node_id, path)]
+        
+        previous = self.device_registry.get_attributes(node_id)
+        if previous:
+            attributes = {
+                path: value for path, value in attributes.items()
+                if path not in previous or previous[path] != value
+            }
+        elif live:
+            attributes = {
+                path: value for path, value in attributes.items()
+                if (node_id, path) not in live
+            }
+        
+        self.device_registry.register_device(node_id, node_data, available, self.sync_generation)
+        self.watchdog.set_timeout(node_id, self._availability_timeout(node_id, node_data))
+        if available:
+            self.watchdog.touch(node_id)
+        else:
+            self.watchdog.forget(node_id)
+        if available != was_available:
+            await self._publish_availability(node_id, available)
+        # Publish initial attributes
+        if attributes:
+            await self.publish_node_attributes(node_id, attributes)
+    
+    async def expire_missing_nodes(self):
+        """Mark nodes missing from the current snapshot as offline."""
+        for node_id, device in list(self.device_registry.devices.items()):
+            if device['generation'] != self.sync_generation and device['available']:
+                devices_logger.info("Node %s (%s) missing after resync", node_id, device['friendly_name'])
+                self.device_registry.update_availability(node_id, False)
+                self.watchdog.forget(node_id)
+                await self._publish_availability(node_id, False)
+    
+    def _availability_timeout(self, node_id: int, node_data: Dict) -> float:
+        """Timeout for a node: device config, then its device class, then the default."""
+        device_config = self.config.get('devices', {}).get(node_id, {})
+        if 'availability_timeout' in device_config:
+            return float(device_config['availability_timeout'] or 0)
+        if not self.availability_timeouts:
+            return self.watchdog.default_timeout
+        
+        device_class = device_config.get('power')
+        if device_class is None:
+            # Power Source cluster reporting BatPercentRemaining -> battery powered
+            attributes = node_data.get('attributes') or {}
+            device_class = 'battery' if any(
+                path.endswith(BATTERY_PERCENT_SUFFIX) for path in attributes
+            ) else 'mains'
+        return self.availability_timeouts.get(device_class, self.watchdog.default_timeout)
+    
+    async def _availability_expired(self, node_id: int):
+        """Mark a node offline after it stayed silent past its timeout."""
+        device = self.device_registry.get_device_by_node_id(node_id)
+        if device and device['available']:
+            devices_logger.info("Node %s (%s) timed out, marking offline", node_id, device['friendly_name'])
+            self.device_registry.update_availability(node_id, False)
+            await self._publish_availability(node_id, False)
     
     async def handle_matter_message(self, message: str):
         """Handle messages from Matter server."""
         try:
-            data = json.loads(message)
-            
-            # Handle different message types
-            event_type = data.get('event')
-            
+            routed = self.route_matter_message(message)
+            if routed is not None:
+                await self.handle_matter_event(routed[1])
+        except Exception as e:
+            matter_logger.error("Error handling Matter message: %s", e)
+    
+    def route_matter_message(self, message: str) -> Optional[Tuple[Any, Dict, Any]]:
+        """Decode a frame. Returns (node_id, event, conflation key) for events, None otherwise.
+        
+        Responses are resolved here so request results never queue behind events.
+        """
+        data = codec.loads(message)
+        
+        if 'event' not in data:
+            if 'message_id' in data:
+                # Response to one of our requests
+                self.metrics.count_message("response")
+                if not self.requests.resolve(data):
+                    matter_logger.debug("Received uncorrelated response: %s", data)
+            return None
+        
+        self.metrics.count_message(data['event'])
+        # Extract nested data field (matter-server wraps events in 'data')
+        event_data = data.get('data', data)
+        conflation_key = None
+        if isinstance(event_data, list) and event_data:
+            node_id = event_data[0]  # attribute_updated: [node_id, path, value]
+            if data['event'] == 'attribute_updated' and len(event_data) >= 3:
+                conflation_key = (node_id, event_data[1])
+        elif isinstance(event_data, dict):
+            node_id = event_data.get('node_id')
+            if data['event'] == 'attribute_updated':
+                path = event_data.get('attribute_path') or {}
+                conflation_key = (node_id, path.get('endpoint_id'), path.get('cluster_id'),
+                                  path.get('attribute_id'))
+        else:
+            node_id = event_data  # node_removed: bare node_id
+        return (node_id, data, conflation_key)
+    
+    async def handle_matter_event(self, data: Dict):
+        """Handle an event from Matter server."""
+        started = time.perf_counter()
+        # Handle different event types
+        event_type = data.get('event')
+        event_data = data.get('data', data)
+        try:
             if event_type == 'attribute_updated':
-                # Extract nested data field (matter-server wraps events in 'data')
-                event_data = data.get('data', data)
                 await self.handle_attribute_update(event_data)
             elif event_type == 'node_added':
-                event_data = data.get('data', data)
                 await self.handle_node_added(event_data)
+            elif event_type == 'node_updated':
+                # Sent on re-interview and when the server's availability flag flips
+                await self.register_node(event_data)
             elif event_type == 'node_removed':
-                event_data = data.get('data', data)
                 await self.handle_node_removed(event_data)
-            elif 'result' in data:
-                # Response to get_nodes command
-                result = data.get('result')
-                if isinstance(result, list):
-                    logger.info(f"Received {len(result)} existing nodes")
-                    for node_data in result:
-                        if isinstance(node_data, dict) and 'node_id' in node_data:
-                            node_id = node_data.get('node_id')
-                            self.device_registry.register_device(node_id, node_data)
-                            await self._publish_availability(node_id, True)
-                            # Publish initial attributes
-                            if 'attributes' in node_data:
-                                await self.publish_node_attributes(node_id, node_data['attributes'])
-                            logger.info(f"Registered device: node {node_id} as '{self.device_registry.get_topic_identifier(node_id)}'")
-            elif data.get('message_id'):
-                # Other responses
-                logger.debug(f"Received response: {data}")
                 
         except Exception as e:
-            logger.error(f"Error handling Matter message: {e}")
+            matter_logger.error("Error handling Matter event: %s", e)
+        
+        elapsed = time.perf_counter() - started
+        if self.slow_handler_threshold and elapsed > self.slow_handler_threshold:
+            self._log_slow_handler(event_type, event_data, elapsed)
+    
+    def _log_slow_handler(self, event_type: str, event_data: Any, elapsed: float):
+        """Report a handler that exceeded the slow handler threshold."""
+        self.metrics.count_slow_handler(event_type)
+        if isinstance(event_data, list) and event_data:
+            node_id = event_data[0]
+            detail = f" {event_data[1]}" if len(event_data) > 1 else ""
+        elif isinstance(event_data, dict):
+            node_id, detail = event_data.get('node_id'), ""
+        else:
+            node_id, detail = event_data, ""
+        ingest_logger.warning("Slow handler: %s for node %s%s took %.1f ms", event_type, node_id, detail, elapsed * 1000)
     
     async def handle_attribute_update(self, data: Dict):
         """Handle attribute update from Matter device."""
@@ -357,11 +2489,13 @@ class MatterMQTTBridge:
                 # Parse attribute path: "endpoint/cluster/attribute"
                 parts = attr_path_str.split('/')
                 if len(parts) == 3:
+                    self._record_attribute(node_id, attr_path_str, value)
+                    self.snapshot_backlog.discard(node_id, attr_path_str)
                     endpoint_id = int(parts[0])
                     cluster_id = int(parts[1])
                     attribute_id = int(parts[2])
                 else:
-                    logger.debug(f"Invalid attribute path format: {attr_path_str}")
+                    matter_logger.debug("Invalid attribute path format: %s", attr_path_str)
                     return
             else:
                 # Old dict format (fallback)
@@ -372,36 +2506,57 @@ class MatterMQTTBridge:
                 cluster_id = attribute_path.get('cluster_id')
                 attribute_id = attribute_path.get('attribute_id')
                 endpoint_id = attribute_path.get('endpoint_id')
+                attr_path_str = f"{endpoint_id}/{cluster_id}/{attribute_id}"
+                self._record_attribute(node_id, attr_path_str, value)
+                self.snapshot_backlog.discard(node_id, attr_path_str)
             
-            # Get device identifier (IEEE or friendly name)
-            device_identifier = self.device_registry.get_topic_identifier(node_id)
-            
-            # Map cluster/attribute to friendly names and MQTT topics
-            topic, payload = self.map_attribute_to_mqtt(
-                device_identifier, cluster_id, attribute_id, endpoint_id, value
-            )
+            # Any report shows the node is alive, even if it is filtered or cannot be mapped
+            device = self.device_registry.get_device_by_node_id(node_id)
+            came_back = device is not None and not device['available']
+            self.device_registry.update_availability(node_id, True)
+            self.watchdog.touch(node_id)
+            if came_back:
+                devices_logger.info("Node %s (%s) is back online", node_id, device['friendly_name'])
+                await self._publish_availability(node_id, True)
             
-            if topic and payload is not None:
-                # Publish to MQTT
-                self.mqtt_client.publish(
-                    topic,
-                    payload=json.dumps(payload) if isinstance(payload, dict) else str(payload),
-                    qos=0,
-                    retain=True
+            if self.attribute_filter.allows(node_id, attr_path_str):
+                # Get precomputed topics (IEEE or friendly name)
+                device_topics = self.device_registry.get_topics(node_id)
+                
+                # Map cluster/attribute to friendly names and MQTT topics
+                topic, payload = self.map_attribute_to_mqtt(
+                    device_topics, cluster_id, attribute_id, endpoint_id, value, node_id
                 )
-                logger.debug(f"Published: {topic}")
+                if topic is None or payload is None:
+                    return
                 
-                # Update availability
-                self.device_registry.update_availability(node_id, True)
+                # Publish to MQTT
+                if self._publish_state(topic, payload):
+                    devices_logger.debug("Published: %s", topic)
+            else:
+                self.metrics.count_mapping("filtered")
                 
         except Exception as e:
-            logger.error(f"Error handling attribute update: {e}")
+            matter_logger.error("Error handling attribute update: %s", e)
+    
+    def _record_attribute(self, node_id: int, attr_path: str, value: Any):
+        """Keep the bridge's attribute state current for resync diffs."""
+        self.device_registry.update_attribute(node_id, attr_path, value)
+        if self.live_updates is not None:
+            self.live_updates[(node_id, attr_path)] = value
     
     async def publish_node_attributes(self, node_id: int, attributes: Dict):
-        """Publish all attributes of a node to MQTT."""
-        device_identifier = self.device_registry.get_topic_identifier(node_id)
-        logger.info(f"Publishing attributes for {device_identifier}")
+        """Publish a node's snapshot attributes to MQTT.
+        
+        Attributes with a converter (sensor and state topics) are queued
+        right away; generic fallback and descriptor attributes go to the
+        background snapshot backlog.
+        """
+        device_topics = self.device_registry.get_topics(node_id)
+        device_identifier = device_topics.identifier
+        devices_logger.debug("Publishing attributes for %s", device_identifier)
         published_count = 0
+        deferred_count = 0
         
         for attr_path, value in attributes.items():
             try:
@@ -409,243 +2564,362 @@ class MatterMQTTBridge:
                 parts = attr_path.split('/')
                 if len(parts) != 3:
                     continue
-                    
-                endpoint_id = int(parts[0])
+                if not self.attribute_filter.allows(node_id, attr_path):
+                    self.metrics.count_mapping("filtered")
+                    continue
                 cluster_id = int(parts[1])
                 attribute_id = int(parts[2])
+                if (cluster_id, attribute_id) not in ATTRIBUTE_CONVERTERS and cluster_id not in CLUSTER_CONVERTERS:
+                    self.snapshot_backlog.add(node_id, attr_path, value)
+                    deferred_count += 1
+                    continue
                 
                 # Map to MQTT and publish
                 topic, payload = self.map_attribute_to_mqtt(
-                    device_identifier, cluster_id, attribute_id, endpoint_id, value
+                    device_topics, cluster_id, attribute_id, int(parts[0]), value, node_id
                 )
                 
-                if topic and payload is not None:
-                    self.mqtt_client.publish(
-                        topic,
-                        payload=json.dumps(payload) if isinstance(payload, dict) else str(payload),
-                        qos=0,
-                        retain=True
-                    )
+                if topic and payload is not None and self._publish_state(topic, payload):
                     published_count += 1
-                    logger.debug(f"Published: {topic} = {payload}")
+                    devices_logger.debug("Published: %s = %s", topic, payload)
                     
             except Exception as e:
-                logger.debug(f"Skipping attribute {attr_path}: {e}")
+                devices_logger.debug("Skipping attribute %s: %s", attr_path, e)
                 continue
         
-        logger.info(f"Published {published_count} attributes for {device_identifier}")
+        devices_logger.debug("Published %s attributes for %s, %s deferred",
+                             published_count, device_identifier, deferred_count)
+    
+    def _publish_snapshot_attribute(self, node_id: int, attr_path: str, value: Any) -> bool:
+        """Publish one attribute from the snapshot backlog."""
+        endpoint_id, cluster_id, attribute_id = (int(part) for part in attr_path.split('/'))
+        topic, payload = self.map_attribute_to_mqtt(
+            self.device_registry.get_topics(node_id), cluster_id, attribute_id, endpoint_id, value, node_id
+        )
+        return topic is not None and payload is not None and self._publish_state(topic, payload, 'bulk')
+    
+    def _publish_state(self, topic: str, payload: Any, priority: str = 'state') -> bool:
+        """Queue a retained state payload unless the change filter drops it."""
+        if not self.change_filter.should_publish(topic, payload):
+            return False
+        if self.state_store is not None:
+            self.published_values[topic] = self.change_filter.comparable(topic, payload)
+            self.unsaved_topics.add(topic)
+        self.metrics.count_publish("generic" if "/cluster_" in topic else "state")
+        self.outbound.put_nowait(
+            topic,
+            payload=codec.dumps(payload) if isinstance(payload, dict) else str(payload),
+            qos=0,
+            retain=True,
+            priority=priority
+        )
+        return True
+    
+    def _outbound_dropped(self, topic: str):
+        """Forget a value that was queued but never published.
+        
+        Otherwise the change filter would suppress it and a warm start would
+        treat it as published, leaving the retained topic stale.
+        """
+        self.change_filter.forget(topic)
+        if self.published_values.pop(topic, None) is not None:
+            self.unsaved_topics.add(topic)
     
-    def map_attribute_to_mqtt(self, device_identifier: str, cluster_id: int, 
+    def map_attribute_to_mqtt(self, device_topics: DeviceTopics, cluster_id: int, 
                               attribute_id: int, endpoint_id: int, 
-                              value: Any) -> tuple:
+                              value: Any, node_id: Optional[int] = None) -> tuple:
         """
         Map Matter attribute to MQTT topic and payload.
-        Topics use friendly name for stability.
+        Topics use friendly name for stability. When the node's capabilities
+        are known, clusters the endpoint does not serve are skipped and
+        endpoints other than the lowest one serving the cluster get their
+        own topic (e.g. state_2), so they do not overwrite each other.
         """
         
         # Validate required fields
         if cluster_id is None or attribute_id is None:
             return (None, None)
         
-        # Temperature Measurement (0x0402)
-        if cluster_id == 0x0402 and attribute_id == 0x0000:  # MeasuredValue
-            temp_c = value / 100.0  # Matter uses hundredths of degree
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/temperature",
-                {
-                    "temperature": round(temp_c, 1),
-                    "unit": "°C",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-            )
-        
-        # Relative Humidity (0x0405)
-        elif cluster_id == 0x0405 and attribute_id == 0x0000:  # MeasuredValue
-            humidity = value / 100.0  # Matter uses hundredths of percent
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/humidity",
-                {
-                    "humidity": round(humidity, 1),
-                    "unit": "%",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-            )
-        
-        # Air Quality (0x005B)
-        elif cluster_id == 0x005B and attribute_id == 0x0000:  # AirQuality
-            quality_map = {
-                0: "unknown",
-                1: "good",
-                2: "fair",
-                3: "moderate",
-                4: "poor",
-                5: "very_poor",
-                6: "extremely_poor"
-            }
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/air_quality",
-                {
-                    "quality": quality_map.get(value, "unknown"),
-                    "value": value,
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-            )
-        
-        # CO2 Concentration (0x040D)
-        elif cluster_id == 0x040D and attribute_id == 0x0000:  # MeasuredValue
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/co2",
-                {
-                    "co2": round(value, 1),
-                    "unit": "ppm",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-            )
-        
-        # PM2.5 Concentration (0x042A)
-        elif cluster_id == 0x042A and attribute_id == 0x0000:  # MeasuredValue
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/pm25",
-                {
-                    "pm25": round(value, 1),
-                    "unit": "µg/m³",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-            )
-        
-        # OnOff (0x0006)
-        elif cluster_id == 0x0006 and attribute_id == 0x0000:  # OnOff
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/state",
-                "ON" if value else "OFF"
-            )
-        
-        # Battery (0x0001) - Power Configuration
-        elif cluster_id == 0x0001 and attribute_id == 0x0021:  # BatteryPercentageRemaining
-            battery = value / 2  # Matter uses 0-200 scale
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/battery",
-                {
-                    "battery": battery,
-                    "unit": "%",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-            )
+        endpoints = None
+        if node_id is not None and endpoint_id is not None:
+            endpoints = self.device_registry.capabilities.endpoints(node_id, cluster_id)
+            # The Descriptor itself is always kept, it is what the index is built from
+            if endpoints is not None and endpoint_id not in endpoints and cluster_id != DESCRIPTOR_CLUSTER_ID:
+                self.metrics.count_mapping("unsupported")
+                return (None, None)
         
-        # LinkQuality (for Thread network)
-        elif cluster_id == 0x0034:  # Thread Network Diagnostics
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/linkquality",
-                value
-            )
+        converter = ATTRIBUTE_CONVERTERS.get((cluster_id, attribute_id))
+        if converter is None:
+            converter = CLUSTER_CONVERTERS.get(cluster_id)
         
         # Generic fallback
+        if converter is None:
+            self.metrics.count_mapping("generic")
+            topic = device_topics.generic_topic(cluster_id, attribute_id)
         else:
-            return (
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/cluster_{cluster_id:04x}/attr_{attribute_id:04x}",
-                value
-            )
+            self.metrics.count_mapping(converter.suffix)
+            topic = device_topics.converters[converter]
+            value = converter.convert(value)
+        
+        if endpoints and endpoint_id != endpoints[0]:
+            topic = device_topics.endpoint_topic(topic, endpoint_id)
+        return (topic, value)
     
     async def _publish_availability(self, node_id: int, available: bool):
         """Publish device availability (like zigbee2mqtt)."""
         device = self.device_registry.get_device_by_node_id(node_id)
         if device:
-            device_identifier = self.device_registry.get_topic_identifier(node_id)
-            self.mqtt_client.publish(
-                f"{MQTT_BASE_TOPIC}/{device_identifier}/availability",
+            await self.publish(
+                device['topics'].availability,
                 payload="online" if available else "offline",
                 qos=1,
-                retain=True
+                retain=True,
+                priority='control',
+                topic_class="availability"
             )
     
     async def handle_node_added(self, data: Dict):
         """Handle new node discovery."""
-        node_id = data.get('node_id')
-        node_info = data.get('node', {})
+        # matter-server sends the node itself (node_id, attributes, ...) as event data
+        node_info = data.get('node', data)
+        node_id = node_info.get('node_id', data.get('node_id'))
         
-        logger.info(f"New Matter node discovered: {node_id}")
+        devices_logger.info("New Matter node discovered: %s", node_id)
         
-        # Register device by node_id
-        self.device_registry.register_device(node_id, node_info)
-        await self._publish_availability(node_id, True)
+        # Register the device, index its capabilities and publish its attributes
+        await self.register_node(dict(node_info, node_id=node_id))
         
         # Publish discovery info to MQTT
         device_identifier = self.device_registry.get_topic_identifier(node_id)
-        self.mqtt_client.publish(
+        await self.publish(
             f"{MQTT_BASE_TOPIC}/bridge/devices",
-            payload=json.dumps({
+            payload=codec.dumps({
                 "event": "device_joined",
                 "node_id": node_id,
                 "friendly_name": device_identifier,
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }),
-            qos=1
+            qos=1,
+            priority='control'
         )
     
     async def handle_node_removed(self, data: Dict):
         """Handle node removal."""
-        node_id = data.get('node_id')
+        # matter-server sends the bare node_id as event data
+        node_id = data if isinstance(data, int) else data.get('node_id')
         device = self.device_registry.get_device_by_node_id(node_id)
         
         if device:
-            logger.info(f"Matter node removed: node {node_id} ({device['friendly_name']})")
+            devices_logger.info("Matter node removed: node %s (%s)", node_id, device['friendly_name'])
             await self._publish_availability(node_id, False)
+            self.device_registry.remove_device(node_id)
+            self.watchdog.forget(node_id)
+            self.snapshot_backlog.forget(node_id)
             
             # Publish removal info to MQTT
-            self.mqtt_client.publish(
+            await self.publish(
                 f"{MQTT_BASE_TOPIC}/bridge/devices",
-                payload=json.dumps({
+                payload=codec.dumps({
                     "event": "device_left",
                     "node_id": node_id,
                     "friendly_name": device['friendly_name'],
                     "timestamp": datetime.now(timezone.utc).isoformat()
                 }),
-                qos=1
+                qos=1,
+                priority='control'
             )
     
     async def publish_bridge_info(self):
-        """Periodically publish bridge status info."""
+        """Publish bridge status info when devices change.
+        
+        Device changes go out on bridge/devices/delta within a second. The full
+        bridge/info and bridge/config/devices documents are only rebuilt when
+        membership, names or availability changed, at most every info_interval.
+        """
+        registry = self.device_registry
+        last_full = None
+        last_stats = time.monotonic()
         while self.running:
             try:
-                # Collect device list
-                devices = []
-                for node_id, dev_info in self.device_registry.devices.items():
-                    devices.append({
-                        "node_id": node_id,
-                        "friendly_name": dev_info['friendly_name'],
-                        "available": dev_info['available'],
-                        "last_seen": dev_info['last_seen'].isoformat()
-                    })
-                
-                info = {
-                    "state": "online",
-                    "version": "2.0",
-                    "devices": devices,
-                    "device_count": len(devices),
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
+                changes = registry.take_changes()
+                if changes:
+                    await self.publish(
+                        f"{MQTT_BASE_TOPIC}/bridge/devices/delta",
+                        payload=codec.dumps({
+                            "changes": changes,
+                            "timestamp": datetime.now(timezone.utc).isoformat()
+                        }),
+                        qos=1,
+                        priority='control'
+                    )
                 
-                self.mqtt_client.publish(
-                    f"{MQTT_BASE_TOPIC}/bridge/info",
-                    payload=json.dumps(info),
-                    qos=0,
-                    retain=True
-                )
+                now = time.monotonic()
+                if registry.info_dirty and (last_full is None or now - last_full >= self.info_interval):
+                    registry.info_dirty = False
+                    last_full = now
+                    await self._publish_full_bridge_info()
                 
-                # Also publish simple device list
-                device_names = [d['friendly_name'] for d in devices]
-                self.mqtt_client.publish(
-                    f"{MQTT_BASE_TOPIC}/bridge/config/devices",
-                    payload=json.dumps(device_names),
-                    qos=0,
-                    retain=True
-                )
+                if now - last_stats >= self.info_interval:
+                    last_stats = now
+                    await self.publish(
+                        f"{MQTT_BASE_TOPIC}/bridge/stats",
+                        payload=codec.dumps({
+                            "ingest": self.ingest.stats(),
+                            "outbound": self.outbound.stats(),
+                            "snapshot": self.snapshot_backlog.stats(),
+                            "metrics": self.metrics.summary(self.ingest)
+                        }),
+                        qos=0
+                    )
                 
-                await asyncio.sleep(60)  # Update every minute
+                await asyncio.sleep(1)
                 
             except Exception as e:
-                logger.error(f"Error publishing bridge info: {e}")
-                await asyncio.sleep(60)
+                logger.error("Error publishing bridge info: %s", e)
+                await asyncio.sleep(self.info_interval)
+    
+    async def _publish_full_bridge_info(self):
+        """Publish the complete bridge/info and bridge/config/devices documents."""
+        # Collect device list
+        devices = []
+        for node_id, dev_info in self.device_registry.devices.items():
+            devices.append({
+                "node_id": node_id,
+                "friendly_name": dev_info['friendly_name'],
+                "ieee_address": dev_info['ieee_address'],
+                "available": dev_info['available'],
+                "last_seen": dev_info['last_seen'].isoformat()
+            })
+        
+        info = {
+            "state": "online",
+            "version": "2.0",
+            "devices": devices,
+            "device_count": len(devices),
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        
+        await self.publish(
+            f"{MQTT_BASE_TOPIC}/bridge/info",
+            payload=codec.dumps(info),
+            qos=0,
+            retain=True
+        )
+        
+        # Also publish simple device list
+        device_names = [d['friendly_name'] for d in devices]
+        await self.publish(
+            f"{MQTT_BASE_TOPIC}/bridge/config/devices",
+            payload=codec.dumps(device_names),
+            qos=0,
+            retain=True
+        )
+    
+    async def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False,
+                      priority: str = 'bulk', topic_class: str = "bridge"):
+        """Queue a message for MQTT, waiting for space if its priority class blocks."""
+        self.metrics.count_publish(topic_class)
+        await self.outbound.put(topic, payload, qos, retain, priority)
+    
+    async def drain_outbound(self):
+        """Hand queued messages to paho while connected, a batch at a time.
+        
+        The next batch is only taken once paho has written the previous one,
+        so its internal buffer stays small and priorities hold.
+        """
+        outbound = self.outbound
+        while self.running:
+            await outbound.ready.wait()
+            await self.mqtt_connected.wait()
+            for _ in range(self.OUTBOUND_BATCH):
+                message = outbound.pop()
+                if message is None:
+                    break
+                topic, payload, qos, retain = message
+                self.mqtt_client.publish(topic, payload=payload, qos=qos, retain=retain)
+            await self.mqtt_adapter.wait_drained()
+            await asyncio.sleep(0)
+    
+    def load_state(self):
+        """Restore registry and published values from the state store."""
+        devices, published = self.state_store.load()
+        for node_id, available, last_seen, info in devices:
+            self.device_registry.register_device(node_id, codec.loads(info), bool(available))
+            if last_seen:
+                self.device_registry.devices[node_id]['last_seen'] = datetime.fromisoformat(last_seen)
+        self.device_registry.unsaved.clear()
+        
+        for topic, value in published:
+            value = codec.loads(value)
+            self.published_values[topic] = value
+            self.change_filter.seed(topic, value)
+        self.device_registry.take_changes()  # Restored devices are not news
+        logger.info("Restored %s devices and %s topics from %s", len(devices), len(published), self.state_store.path)
+    
+    def _collect_state(self) -> Tuple[List[Tuple], List[int], List[Tuple]]:
+        """Serialize everything changed since the last checkpoint."""
+        registry = self.device_registry
+        devices, removed = [], []
+        for node_id in registry.unsaved:
+            device = registry.devices.get(node_id)
+            if device is None:
+                removed.append(node_id)
+                continue
+            devices.append((
+                node_id,
+                int(device['available']),
+                device['last_seen'].isoformat(),
+                codec.dumps(device['info'])
+            ))
+        registry.unsaved.clear()
+        
+        # Topics whose value was dropped before publishing are deleted
+        published = [(topic, codec.dumps(self.published_values[topic]) if topic in self.published_values else None)
+                     for topic in self.unsaved_topics]
+        self.unsaved_topics.clear()
+        return devices, removed, published
+    
+    async def checkpoint_state(self):
+        """Periodically write changed state to the state store."""
+        while self.running:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                devices, removed, published = self._collect_state()
+                if devices or removed or published:
+                    await asyncio.to_thread(self.state_store.save, devices, removed, published)
+                    logger.debug("Checkpointed %s devices, %s topics", len(devices), len(published))
+            except Exception as e:
+                logger.error("Error writing state checkpoint: %s", e)
+    
+    async def serve_metrics(self):
+        """Serve Prometheus metrics over HTTP on /metrics."""
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request_line = await reader.readline()
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass  # Skip headers
+                parts = request_line.split()
+                if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                    status = "200 OK"
+                    body = self.metrics.prometheus(self.ingest, self.outbound, self.snapshot_backlog).encode()
+                else:
+                    status, body = "404 Not Found", b"Not found\n"
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: close\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+        
+        server = await asyncio.start_server(handle, self.metrics_host, self.metrics_port)
+        logger.info("Serving metrics on http://%s:%s/metrics", self.metrics_host, self.metrics_port)
+        async with server:
+            await server.serve_forever()
     
     async def run(self):
         """Main run loop."""
@@ -654,11 +2928,24 @@ class MatterMQTTBridge:
         # Set up MQTT
         self.setup_mqtt()
         
+        # Start message handling workers
+        self.ingest.start()
+        
         # Create tasks
         tasks = [
             asyncio.create_task(self.connect_matter_server()),
-            asyncio.create_task(self.publish_bridge_info())
+            asyncio.create_task(self.publish_bridge_info()),
+            asyncio.create_task(self.watchdog.run()),
+            asyncio.create_task(self.drain_outbound()),
+            asyncio.create_task(self.snapshot_backlog.run()),
+            asyncio.create_task(self.loop_monitor.run())
         ]
+        if self.metrics_port:
+            tasks.append(asyncio.create_task(self.serve_metrics()))
+        if PROFILE_SECONDS > 0:
+            self.profiler.start(PROFILE_SECONDS)
+        if self.state_store is not None:
+            tasks.append(asyncio.create_task(self.checkpoint_state()))
         
         # Wait for tasks
         await asyncio.gather(*tasks)
@@ -667,17 +2954,40 @@ class MatterMQTTBridge:
         """Stop the bridge."""
         logger.info("Stopping Matter MQTT Bridge...")
         self.running = False
+        self.ingest.stop()
+        self.profiler.stop()
+        self.loop_monitor.stop()
         
         # Publish offline status
         if self.mqtt_client:
+            self.mqtt_adapter.stop()
+            # Hand what is still queued to paho, best effort
+            message = self.outbound.pop() if self.mqtt_connected.is_set() else None
+            while message is not None:
+                topic, payload, qos, retain = message
+                self.mqtt_client.publish(topic, payload=payload, qos=qos, retain=retain)
+                message = self.outbound.pop()
             self.mqtt_client.publish(
                 f"{MQTT_BASE_TOPIC}/bridge/state",
                 payload="offline",
                 qos=1,
                 retain=True
             )
-            self.mqtt_client.loop_stop()
             self.mqtt_client.disconnect()
+            # No network thread: flush the offline state and DISCONNECT now
+            self.mqtt_client.loop_write()
+        
+        # Final checkpoint
+        if self.state_store is not None:
+            try:
+                self.state_store.save(*self._collect_state())
+                self.state_store.close()
+            except Exception as e:
+                logger.error("Error writing state on shutdown: %s", e)
+        
+        if self.capture is not None:
+            self.capture.close()
+            logger.info("Captured %s frames to %s", self.capture.frames, self.capture.path)
 
 
 def signal_handler(sig, frame):
@@ -696,6 +3006,14 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
+    if EVENT_LOOP == 'uvloop':
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logger.info("Using uvloop event loop")
+        except ImportError:
+            logger.warning("uvloop is not installed, using the default asyncio event loop")
+    
     # Create and run bridge
     bridge = MatterMQTTBridge()
     
@@ -705,5 +3023,5 @@ if __name__ == "__main__":
         logger.info("Keyboard interrupt received")
         bridge.stop()
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
         sys.exit(1)